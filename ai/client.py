@@ -1,13 +1,36 @@
 import os
+import random
+import asyncio
+import logging
+import functools
+import importlib
+from typing import Awaitable, Callable
 from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
+_async_client = None
+_semaphore: asyncio.Semaphore | None = None
 provider = os.getenv("AI_PROVIDER", "openai").lower()
 model = os.getenv("AI_MODEL", "gpt-4o-mini")
 
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_POOL_SIZE = int(os.getenv("AI_POOL_SIZE", "20"))
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "5"))
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", "60"))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "30"))
+
+# 529 is Anthropic's "overloaded"
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
 
 def get_client():
     """Lazy initialization of AI client based on AI_PROVIDER."""
@@ -22,40 +45,289 @@ def get_client():
     return _client
 
 
+def get_async_client():
+    """Lazy initialization of the async AI client and its shared connection pool.
+
+    Retries are disabled in the SDK; chat_async handles them itself.
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        timeout = httpx.Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT)
+        http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=AI_POOL_SIZE, max_keepalive_connections=AI_POOL_SIZE),
+        )
+        if provider == "anthropic":
+            from anthropic import AsyncAnthropic
+            _async_client = AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                http_client=http_client,
+                timeout=timeout,
+                max_retries=0,
+            )
+        else:
+            from openai import AsyncOpenAI
+            _async_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=http_client,
+                timeout=timeout,
+                max_retries=0,
+            )
+    return _async_client
+
+
 @dataclass
 class AIResponse:
     text: str
-    input_tokens: int = 0
+    input_tokens: int = 0  # all input tokens, cached or not
     output_tokens: int = 0
+    cached_input_tokens: int = 0  # part of input_tokens read from the prompt cache
+
+
+def _anthropic_request(
+    messages: list[dict], system: str | None, max_tokens: int, cached_system: str | None = None,
+) -> dict:
+    kwargs = dict(model=model, max_tokens=max_tokens, messages=messages)
+    if cached_system:
+        blocks = [{"type": "text", "text": cached_system, "cache_control": {"type": "ephemeral"}}]
+        if system:
+            blocks.append({"type": "text", "text": system})
+        kwargs["system"] = blocks
+    elif system:
+        kwargs["system"] = system
+    return kwargs
 
 
-def chat(messages: list[dict], system: str | None = None, max_tokens: int = 1024) -> AIResponse:
-    """Unified chat call that works with both providers."""
+def _anthropic_response(response) -> AIResponse:
+    usage = response.usage
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return AIResponse(
+        text=response.content[0].text,
+        # Anthropic reports cached and cache-creation tokens separately from input_tokens
+        input_tokens=usage.input_tokens + cache_read + cache_write,
+        output_tokens=usage.output_tokens,
+        cached_input_tokens=cache_read,
+    )
+
+
+def _openai_request(
+    messages: list[dict], system: str | None, max_tokens: int, cached_system: str | None = None,
+) -> dict:
+    # OpenAI caches long prompt prefixes automatically; it only needs
+    # the static part first so the prefix is identical across calls.
+    system = "\n\n".join(part for part in (cached_system, system) if part)
+    openai_messages = []
+    if system:
+        openai_messages.append({"role": "system", "content": system})
+    openai_messages.extend(messages)
+    return dict(model=model, max_tokens=max_tokens, messages=openai_messages)
+
+
+def _openai_usage(text: str, usage) -> AIResponse:
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return AIResponse(
+        text=text,
+        input_tokens=usage.prompt_tokens if usage else 0,
+        output_tokens=usage.completion_tokens if usage else 0,
+        cached_input_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0,
+    )
+
+
+def _openai_response(response) -> AIResponse:
+    return _openai_usage(response.choices[0].message.content, response.usage)
+
+
+def chat(
+    messages: list[dict],
+    system: str | None = None,
+    max_tokens: int = 1024,
+    cached_system: str | None = None,
+) -> AIResponse:
+    """Unified chat call that works with both providers.
+
+    cached_system is a static system prompt prefix placed before `system`
+    and marked for provider-side prompt caching.
+    """
     client = get_client()
 
     if provider == "anthropic":
-        kwargs = dict(model=model, max_tokens=max_tokens, messages=messages)
-        if system:
-            kwargs["system"] = system
-        response = client.messages.create(**kwargs)
-        return AIResponse(
-            text=response.content[0].text,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-        )
+        response = client.messages.create(**_anthropic_request(messages, system, max_tokens, cached_system))
+        return _anthropic_response(response)
     else:
-        openai_messages = []
-        if system:
-            openai_messages.append({"role": "system", "content": system})
-        openai_messages.extend(messages)
-        response = client.chat.completions.create(
-            model=model,
-            max_tokens=max_tokens,
-            messages=openai_messages,
-        )
-        usage = response.usage
-        return AIResponse(
-            text=response.choices[0].message.content,
-            input_tokens=usage.prompt_tokens if usage else 0,
-            output_tokens=usage.completion_tokens if usage else 0,
-        )
+        response = client.chat.completions.create(**_openai_request(messages, system, max_tokens, cached_system))
+        return _openai_response(response)
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def _retry_after(headers) -> float | None:
+    """Server-requested delay from retry-after-ms / retry-after headers."""
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+@functools.cache
+def _connection_errors() -> tuple[type[Exception], ...]:
+    """Connection and timeout errors of the provider SDKs that are installed."""
+    errors = []
+    for name in ("openai", "anthropic"):
+        try:
+            sdk = importlib.import_module(name)
+        except ImportError:
+            continue
+        errors += [sdk.APIConnectionError, sdk.APITimeoutError]
+    return tuple(errors)
+
+
+def _retry_delay(error: Exception, attempt: int) -> float | None:
+    """Seconds to wait before retrying `error`, or None if it is not retryable."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        if status not in RETRYABLE_STATUS_CODES:
+            return None
+    elif not isinstance(error, _connection_errors()):
+        return None
+
+    response = getattr(error, "response", None)
+    delay = _retry_after(response.headers if response is not None else None)
+    if delay is None:
+        # Exponential backoff with full jitter
+        delay = random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * 2 ** attempt))
+    return min(delay, AI_RETRY_MAX_DELAY)
+
+
+async def chat_async(
+    messages: list[dict],
+    system: str | None = None,
+    max_tokens: int = 1024,
+    cached_system: str | None = None,
+) -> AIResponse:
+    """Async counterpart of chat() for use in the event loop.
+
+    At most AI_MAX_CONCURRENCY requests are in flight across the process.
+    Rate limits, overloads and connection errors are retried up to
+    AI_MAX_RETRIES times, honouring retry-after headers when present.
+    """
+    client = get_async_client()
+
+    for attempt in range(AI_MAX_RETRIES + 1):
+        try:
+            async with _get_semaphore():
+                if provider == "anthropic":
+                    request = _anthropic_request(messages, system, max_tokens, cached_system)
+                    return _anthropic_response(await client.messages.create(**request))
+                request = _openai_request(messages, system, max_tokens, cached_system)
+                return _openai_response(await client.chat.completions.create(**request))
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == AI_MAX_RETRIES:
+                raise
+            logger.warning(
+                "LLM request failed (%s), retry %d/%d in %.1fs",
+                type(e).__name__, attempt + 1, AI_MAX_RETRIES, delay,
+            )
+            await asyncio.sleep(delay)
+
+
+async def _stream_anthropic(client, request: dict, on_delta: Callable[[str], Awaitable[None]]) -> AIResponse:
+    async with client.messages.stream(**request) as stream:
+        async for text in stream.text_stream:
+            await on_delta(text)
+        final = await stream.get_final_message()
+    return _anthropic_response(final)
+
+
+async def _stream_openai(client, request: dict, on_delta: Callable[[str], Awaitable[None]]) -> AIResponse:
+    stream = await client.chat.completions.create(
+        **request, stream=True, stream_options={"include_usage": True},
+    )
+    parts = []
+    usage = None
+    async for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            await on_delta(chunk.choices[0].delta.content)
+    return _openai_usage("".join(parts), usage)
+
+
+async def chat_stream(
+    messages: list[dict],
+    on_delta: Callable[[str], Awaitable[None]],
+    system: str | None = None,
+    max_tokens: int = 1024,
+    cached_system: str | None = None,
+) -> AIResponse:
+    """Like chat_async(), but awaits on_delta(text) for each chunk as it arrives.
+
+    Returns the complete response with usage once the stream ends and
+    every chunk has been passed on. Failures are retried only until the
+    first chunk has been received.
+
+    on_delta runs in a separate task, outside the concurrency limit, so
+    slow callbacks (Telegram edits) do not hold a slot other users' LLM
+    calls are waiting for; chunks queue up until it catches up.
+    """
+    client = get_async_client()
+    chunks: asyncio.Queue[str | None] = asyncio.Queue()
+    delivered = False
+
+    async def forward(text: str) -> None:
+        nonlocal delivered
+        delivered = True
+        chunks.put_nowait(text)
+
+    async def deliver() -> None:
+        while (text := await chunks.get()) is not None:
+            await on_delta(text)
+
+    async def stream() -> AIResponse:
+        for attempt in range(AI_MAX_RETRIES + 1):
+            try:
+                async with _get_semaphore():
+                    if provider == "anthropic":
+                        request = _anthropic_request(messages, system, max_tokens, cached_system)
+                        return await _stream_anthropic(client, request, forward)
+                    request = _openai_request(messages, system, max_tokens, cached_system)
+                    return await _stream_openai(client, request, forward)
+            except Exception as e:
+                delay = None if delivered else _retry_delay(e, attempt)
+                if delay is None or attempt == AI_MAX_RETRIES:
+                    raise
+                logger.warning(
+                    "LLM stream failed (%s), retry %d/%d in %.1fs",
+                    type(e).__name__, attempt + 1, AI_MAX_RETRIES, delay,
+                )
+                await asyncio.sleep(delay)
+
+    consumer = asyncio.create_task(deliver())
+    try:
+        response = await stream()
+    except BaseException:
+        consumer.cancel()
+        raise
+    chunks.put_nowait(None)
+    await consumer
+    return response
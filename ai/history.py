@@ -0,0 +1,110 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Sequence
+
+from ai.tokens import count_tokens
+from conversation import Exchange
+
+# Token budgets for the replayed conversation in each LLM call
+SQL_HISTORY_TOKEN_BUDGET = int(os.getenv("QA_SQL_HISTORY_TOKEN_BUDGET", "1500"))
+ANSWER_HISTORY_TOKEN_BUDGET = int(os.getenv("QA_ANSWER_HISTORY_TOKEN_BUDGET", "1500"))
+# Most recent exchanges replayed verbatim (if they fit); older ones become digests
+RECENT_EXCHANGES = int(os.getenv("QA_RECENT_EXCHANGES", "2"))
+DIGEST_MAX_CHARS = int(os.getenv("QA_DIGEST_MAX_CHARS", "160"))
+
+_DIGEST_HEADER = "Ранее в диалоге (кратко):"
+
+
+@dataclass
+class History:
+    messages: list[dict]  # alternating user/assistant turns, without the new question
+    prefix: str  # digest of older exchanges, to prepend to the first user turn
+    tokens: int
+    full_tokens: int  # what replaying every exchange verbatim would cost
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.full_tokens - self.tokens, 0)
+
+
+def _shorten(text: str, limit: int = DIGEST_MAX_CHARS) -> str:
+    text = re.sub(r"\s+", " ", text).strip()
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _first_sentence(text: str) -> str:
+    return re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+
+
+def _select(
+    exchanges: Sequence[Exchange],
+    reply: Callable[[Exchange], str],
+    digest: Callable[[Exchange], str],
+    budget: int,
+) -> History:
+    """Newest exchanges verbatim, then digests of older ones, within `budget` tokens."""
+    verbatim: list[Exchange] = []
+    digests: list[str] = []
+    used = count_tokens(_DIGEST_HEADER)
+    full = 0
+
+    for i, ex in enumerate(reversed(exchanges)):
+        ex_tokens = count_tokens(ex.question) + count_tokens(reply(ex))
+        full += ex_tokens
+        if not digests and i < RECENT_EXCHANGES and used + ex_tokens <= budget:
+            verbatim.append(ex)
+            used += ex_tokens
+            continue
+        line = digest(ex)
+        line_tokens = count_tokens(line) + 1
+        if used + line_tokens > budget:
+            # Budget spent: everything older is dropped
+            full += sum(count_tokens(e.question) + count_tokens(reply(e)) for e in exchanges[:-i - 1])
+            break
+        digests.append(line)
+        used += line_tokens
+
+    messages = []
+    for ex in reversed(verbatim):
+        messages.append({"role": "user", "content": ex.question})
+        messages.append({"role": "assistant", "content": reply(ex)})
+    prefix = "\n".join([_DIGEST_HEADER, *reversed(digests)]) + "\n\n" if digests else ""
+    tokens = used if digests else used - count_tokens(_DIGEST_HEADER)
+    return History(messages=messages, prefix=prefix, tokens=tokens, full_tokens=full)
+
+
+def sql_history(exchanges: Sequence[Exchange], budget: int = SQL_HISTORY_TOKEN_BUDGET) -> History:
+    """Context for SQL generation: questions and their SQL, never the answers.
+
+    Older exchanges keep only the question; their SQL is rarely referred
+    to and a shortened query costs about as much as the full one.
+    """
+    return _select(
+        exchanges,
+        reply=lambda ex: ex.sql,
+        digest=lambda ex: f"- {_shorten(ex.question)}",
+        budget=budget,
+    )
+
+
+def answer_history(exchanges: Sequence[Exchange], budget: int = ANSWER_HISTORY_TOKEN_BUDGET) -> History:
+    """Context for answer generation: questions and answers, older ones cut to one sentence."""
+    return _select(
+        exchanges,
+        reply=lambda ex: ex.answer,
+        digest=lambda ex: f"- {_shorten(ex.question)} → {_shorten(_first_sentence(ex.answer))}",
+        budget=budget,
+    )
+
+
+def with_prefix(messages: list[dict], prefix: str, question: str) -> list[dict]:
+    """Append the new question and put the digest prefix before the first user turn.
+
+    The digest goes into an existing user message rather than a turn of
+    its own, so roles keep alternating as the providers require.
+    """
+    messages = [*messages, {"role": "user", "content": question}]
+    if prefix:
+        messages[0] = {**messages[0], "content": prefix + messages[0]["content"]}
+    return messages
@@ -1,4 +1,5 @@
-from ai.client import chat
+from typing import Awaitable, Callable
+from ai.client import chat_async, chat_stream
 
 ACTIVITY_REPORT_PROMPT = """Ты аналитик образовательной платформы в России.
 
@@ -32,7 +33,7 @@ ACTIVITY_REPORT_PROMPT = """Ты аналитик образовательной
 📋 СТАТУСЫ РАБОТ:
 {status_breakdown}
 
-Напиши краткий аналитический отчёт для Telegram (4-6 пунктов):
+{missing_note}Напиши краткий аналитический отчёт для Telegram (4-6 пунктов):
 1. Динамика активности по сравнению со вчера и прошлой неделей
 2. Тренд текущей недели (только с понедельника) — рост или падение
 3. Самые активные школы
@@ -64,8 +65,14 @@ ACTIVITY_REPORT_PROMPT = """Ты аналитик образовательной
 """
 
 
-def generate_activity_report(metrics: dict) -> str:
-    """Generate activity/engagement report from metrics."""
+async def generate_activity_report(
+    metrics: dict,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+) -> str:
+    """Generate activity/engagement report from metrics.
+
+    If on_delta is given, the report text is streamed to it as it is generated.
+    """
     today = metrics.get("activity_today", {})
     yesterday = metrics.get("activity_yesterday", {})
     weekly = metrics.get("weekly_comparison", {})
@@ -99,6 +106,15 @@ def generate_activity_report(metrics: dict) -> str:
     this_week_dates = f"{this_week.get('start_date', '?')} — {this_week.get('end_date', '?')}"
     last_week_dates = f"{last_week.get('start_date', '?')} — {last_week.get('end_date', '?')}"
 
+    # Sections that failed to load must not be read as "zero activity"
+    missing = metrics.get("missing", [])
+    missing_note = ""
+    if missing:
+        missing_note = (
+            "⚠️ НЕ УДАЛОСЬ ЗАГРУЗИТЬ РАЗДЕЛЫ: " + ", ".join(missing)
+            + ". Не делай выводов по ним и отметь в отчёте, что эти данные недоступны.\n\n"
+        )
+
     prompt = ACTIVITY_REPORT_PROMPT.format(
         date=metrics.get("date", ""),
         submissions_today=today.get("total_submissions", 0),
@@ -121,7 +137,12 @@ def generate_activity_report(metrics: dict) -> str:
         top_schools=schools_text or "  Нет данных",
         top_regions=regions_text or "  Нет данных",
         status_breakdown=status_text or "  Нет данных",
+        missing_note=missing_note,
     )
 
-    response = chat(messages=[{"role": "user", "content": prompt}])
+    messages = [{"role": "user", "content": prompt}]
+    if on_delta is not None:
+        response = await chat_stream(messages=messages, on_delta=on_delta)
+    else:
+        response = await chat_async(messages=messages)
     return response.text
@@ -0,0 +1,93 @@
+import os
+import logging
+from dataclasses import dataclass
+from ai.sql_guard import add_date_window, has_date_filter
+from queries.estimate import CostEstimate, estimate_query_async
+
+logger = logging.getLogger(__name__)
+
+# Hard ceilings, whatever the query
+QA_MAX_ESTIMATED_ROWS = int(os.getenv("QA_MAX_ESTIMATED_ROWS", "20000000"))
+QA_MAX_ESTIMATED_PARTS = int(os.getenv("QA_MAX_ESTIMATED_PARTS", "500"))
+QA_MAX_ESTIMATED_BYTES = int(os.getenv("QA_MAX_ESTIMATED_BYTES", str(2 * 1024 ** 3)))
+# Share of the table a query without a date filter may read. Beyond it
+# the query is a full-history scan, however small the table is today
+QA_MAX_UNFILTERED_SCAN_FRACTION = float(os.getenv("QA_MAX_UNFILTERED_SCAN_FRACTION", "0.5"))
+# Window applied to queries without a date filter that are over the limits
+QA_DEFAULT_DATE_WINDOW_DAYS = int(os.getenv("QA_DEFAULT_DATE_WINDOW_DAYS", "30"))
+
+
+class QueryTooExpensive(Exception):
+    """Raised when a query would read more than the configured limits allow."""
+
+    def __init__(self, message: str, estimate: CostEstimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+@dataclass
+class Preflight:
+    sql: str  # the query to run, possibly rewritten
+    estimate: CostEstimate | None  # None if the estimate could not be made
+    date_window_days: int | None = None  # set if a default date window was added
+
+
+def over_limits(estimate: CostEstimate, date_filtered: bool = True) -> list[str]:
+    """Which of the thresholds an estimate exceeds, as readable strings."""
+    exceeded = []
+    if (
+        not date_filtered
+        and estimate.table_rows
+        and estimate.rows >= QA_MAX_UNFILTERED_SCAN_FRACTION * estimate.table_rows
+    ):
+        exceeded.append(f"rows {estimate.rows} of {estimate.table_rows} without a date filter")
+    if estimate.rows > QA_MAX_ESTIMATED_ROWS:
+        exceeded.append(f"rows {estimate.rows} > {QA_MAX_ESTIMATED_ROWS}")
+    if estimate.parts > QA_MAX_ESTIMATED_PARTS:
+        exceeded.append(f"parts {estimate.parts} > {QA_MAX_ESTIMATED_PARTS}")
+    if estimate.bytes > QA_MAX_ESTIMATED_BYTES:
+        exceeded.append(f"bytes {estimate.bytes} > {QA_MAX_ESTIMATED_BYTES}")
+    return exceeded
+
+
+async def preflight_query(sql: str) -> Preflight:
+    """Check what a guarded query would read before running it.
+
+    A query within the limits runs as is. One without a date filter that
+    reads most of the table, or is over the hard limits, is retried with
+    the last QA_DEFAULT_DATE_WINDOW_DAYS days; if that is still too much,
+    or the query already filters by date, QueryTooExpensive is raised. If the estimate itself fails the query
+    runs unchecked -- the per-query settings from the guard still apply.
+    """
+    try:
+        estimate = await estimate_query_async(sql)
+    except Exception as e:
+        logger.warning("Cost estimate failed, running query unchecked: %s", e)
+        return Preflight(sql=sql, estimate=None)
+
+    date_filtered = has_date_filter(sql)
+    exceeded = over_limits(estimate, date_filtered)
+    if not exceeded:
+        return Preflight(sql=sql, estimate=estimate)
+    if date_filtered:
+        raise QueryTooExpensive(f"Query too expensive: {', '.join(exceeded)}", estimate)
+
+    windowed = add_date_window(sql, QA_DEFAULT_DATE_WINDOW_DAYS)
+    try:
+        windowed_estimate = await estimate_query_async(windowed)
+    except Exception as e:
+        logger.warning("Cost estimate of windowed query failed: %s", e)
+        raise QueryTooExpensive(f"Query too expensive: {', '.join(exceeded)}", estimate) from None
+
+    exceeded = over_limits(windowed_estimate)
+    if exceeded:
+        raise QueryTooExpensive(
+            f"Query too expensive even for the last {QA_DEFAULT_DATE_WINDOW_DAYS} days: "
+            f"{', '.join(exceeded)}",
+            windowed_estimate,
+        )
+    logger.info(
+        "Query over limits, limited to the last %d days | Rows: %d -> %d",
+        QA_DEFAULT_DATE_WINDOW_DAYS, estimate.rows, windowed_estimate.rows,
+    )
+    return Preflight(sql=windowed, estimate=windowed_estimate, date_window_days=QA_DEFAULT_DATE_WINDOW_DAYS)
@@ -1,10 +1,22 @@
+import asyncio
 import logging
 import time as _time
+from typing import Awaitable, Callable, Sequence
 from dataclasses import dataclass
 from datetime import date
-from queries.base import execute_query
-from conversation import ConversationStore
-from ai.client import chat
+from queries.base import execute_query_columnar_async
+from queries.activity import get_data_watermark
+from queries.result_cache import ResultCache
+from queries.estimate import CostEstimate
+from conversation import ConversationStore, Exchange
+from ai.client import chat_async, chat_stream, model as ai_model
+from ai.sql_cache import SQLCache, SQL_CACHE_PATH, fingerprint
+from ai.serialize import serialize_result
+from ai.history import answer_history, sql_history, with_prefix
+from ai.sql_guard import QA_MAX_EXECUTION_TIME, SQLRejected, guard_sql
+from ai.preflight import Preflight, QueryTooExpensive, preflight_query
+from ai.summarize import summarize_result
+from ai.tokens import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -88,7 +100,6 @@ SQL_SYSTEM_PROMPT = """Ты SQL-эксперт для аналитики обр
 
 ## Правила
 - Только SELECT (никаких INSERT/UPDATE/DELETE/DROP)
-- Сегодня: {today}
 - Используй today() для текущей даты
 - Используй LIMIT при необходимости
 - Для подсчёта уникальных значений используй uniqExact()
@@ -99,6 +110,13 @@ SQL_SYSTEM_PROMPT = """Ты SQL-эксперт для аналитики обр
 - Возвращай ТОЛЬКО SQL запрос, без пояснений и markdown
 - Если пользователь ссылается на предыдущий вопрос или запрос, используй контекст из истории диалога"""
 
+# Most rows passed to the answer prompt verbatim; larger results are summarized
+MAX_ROWS = 100
+
+# Kept out of SQL_SYSTEM_PROMPT so the large static prefix is identical on
+# every call and can be served from the provider's prompt cache.
+SQL_DATE_PROMPT = "Сегодня: {today}"
+
 ANSWER_SYSTEM_PROMPT = """Ты аналитик образовательной платформы.
 Отвечай кратко и понятно на русском языке. Если данных нет или запрос не вернул результатов, скажи об этом.
 Если пользователь ссылается на предыдущий вопрос, используй контекст из истории диалога."""
@@ -114,91 +132,219 @@ class QAResult:
     sql_execution_time_ms: int | None = None
     input_tokens: int = 0
     output_tokens: int = 0
+    cached_input_tokens: int = 0
+    sql_cache_hit: bool = False
+    sql_result_cached: bool = False  # sql_execution_time_ms is then the cache lookup time
+    result_tokens_saved: int = 0  # vs. passing the raw repr of the rows
+    history_tokens_saved: int = 0  # vs. replaying every past exchange verbatim
+    # EXPLAIN ESTIMATE of the executed query; None if not estimated
+    estimated_rows: int | None = None
+    estimated_parts: int | None = None
+    estimated_bytes: int | None = None
+    date_window_days: int | None = None  # set if a default date window was applied
+
+
+qa_result_cache = ResultCache()
+
+_sql_cache: SQLCache | None = None
+_sql_cache_disabled = False
+
+
+def _get_sql_cache() -> SQLCache | None:
+    """Lazy initialization of the question -> SQL cache. None if unavailable."""
+    global _sql_cache, _sql_cache_disabled
+    if _sql_cache is None and not _sql_cache_disabled:
+        try:
+            _sql_cache = SQLCache(
+                SQL_CACHE_PATH,
+                fingerprint(SQL_SYSTEM_PROMPT, DATABASE_SCHEMA, SQL_EXAMPLES, ai_model),
+            )
+        except Exception as e:
+            logger.warning("SQL cache unavailable, disabling it: %s", e)
+            _sql_cache_disabled = True
+    return _sql_cache
+
+
+async def _lookup_cached_sql(cache: SQLCache, question: str, today: str) -> str | None:
+    try:
+        return await asyncio.to_thread(cache.get, question, today)
+    except Exception as e:
+        logger.warning("SQL cache lookup failed: %s", e)
+        return None
 
 
-def _build_sql_messages(exchanges: list[dict], question: str) -> list[dict]:
-    """Build message history for SQL generation."""
-    messages = []
-    for ex in exchanges:
-        messages.append({"role": "user", "content": ex["question"]})
-        messages.append({"role": "assistant", "content": ex["sql"]})
-    messages.append({"role": "user", "content": question})
-    return messages
-
-
-def _build_answer_messages(exchanges: list[dict], question: str, results_text: str) -> list[dict]:
-    """Build message history for answer generation."""
-    messages = []
-    for ex in exchanges:
-        messages.append({"role": "user", "content": ex["question"]})
-        messages.append({"role": "assistant", "content": ex["answer"]})
-    messages.append({"role": "user", "content": f"{question}\n\nРезультат запроса:\n{results_text}"})
-    return messages
-
+async def _store_cached_sql(cache: SQLCache, question: str, today: str, sql: str) -> None:
+    try:
+        await asyncio.to_thread(cache.put, question, today, sql)
+    except Exception as e:
+        logger.warning("SQL cache store failed: %s", e)
 
-def answer_question(question: str, user_id: int, store: ConversationStore) -> QAResult:
-    """Answer a user question about the data with conversation context."""
-    exchanges = store.get_exchanges(user_id)
 
-    # Step 1: Generate SQL query
-    sql_system = SQL_SYSTEM_PROMPT.format(
-        schema=DATABASE_SCHEMA,
-        examples=SQL_EXAMPLES,
-        today=date.today(),
-    )
-    sql_messages = _build_sql_messages(exchanges, question)
+async def _current_watermark() -> date | None:
+    """Data watermark for result-cache keys; None if it cannot be read."""
+    try:
+        return await get_data_watermark()
+    except Exception as e:
+        logger.warning("Could not read data watermark: %s", e)
+        return None
+
+
+def _estimate_fields(estimate: CostEstimate | None) -> dict:
+    if estimate is None:
+        return {}
+    return {
+        "estimated_rows": estimate.rows,
+        "estimated_parts": estimate.parts,
+        "estimated_bytes": estimate.bytes,
+    }
+
+
+def _build_sql_messages(exchanges: Sequence[Exchange], question: str) -> tuple[list[dict], int]:
+    """Build token-budgeted message history for SQL generation.
+
+    Returns the messages and the tokens saved vs. replaying every exchange.
+    """
+    history = sql_history(exchanges)
+    return with_prefix(history.messages, history.prefix, question), history.tokens_saved
+
+
+def _build_answer_messages(
+    exchanges: Sequence[Exchange], question: str, results_text: str,
+) -> tuple[list[dict], int]:
+    """Build token-budgeted message history for answer generation."""
+    history = answer_history(exchanges)
+    content = f"{question}\n\nРезультат запроса:\n{results_text}"
+    return with_prefix(history.messages, history.prefix, content), history.tokens_saved
+
+
+async def answer_question(
+    question: str,
+    user_id: int,
+    store: ConversationStore,
+    on_answer_delta: Callable[[str], Awaitable[None]] | None = None,
+) -> QAResult:
+    """Answer a user question about the data with conversation context.
+
+    If on_answer_delta is given, the final answer is streamed to it chunk
+    by chunk while it is being generated.
+    """
+    exchanges = await store.fetch_exchanges(user_id)
+    today = str(date.today())
+
+    # Step 1: Generate SQL query (or reuse it for a repeated standalone question;
+    # follow-ups depend on the conversation, so they always go to the LLM)
+    sql_cache = _get_sql_cache() if not exchanges else None
+    cached_sql = await _lookup_cached_sql(sql_cache, question, today) if sql_cache else None
+    sql_cache_hit = cached_sql is not None
+
+    if sql_cache_hit:
+        logger.info("SQL cache hit | Question: %s", question)
+        sql_query = cached_sql
+        history_tokens_saved = 0
+        total_input = 0
+        total_output = 0
+        total_cached = 0
+    else:
+        sql_messages, history_tokens_saved = _build_sql_messages(exchanges, question)
 
-    query_response = chat(messages=sql_messages, system=sql_system, max_tokens=500)
+        query_response = await chat_async(
+            messages=sql_messages,
+            cached_system=SQL_SYSTEM_PROMPT.format(schema=DATABASE_SCHEMA, examples=SQL_EXAMPLES),
+            system=SQL_DATE_PROMPT.format(today=today),
+            max_tokens=500,
+        )
 
-    sql_query = query_response.text.strip()
-    total_input = query_response.input_tokens
-    total_output = query_response.output_tokens
+        sql_query = query_response.text.strip()
+        total_input = query_response.input_tokens
+        total_output = query_response.output_tokens
+        total_cached = query_response.cached_input_tokens
 
-    # Clean up query (remove markdown code blocks if present)
-    if sql_query.startswith("```"):
-        sql_query = sql_query.split("\n", 1)[1]
-    if sql_query.endswith("```"):
-        sql_query = sql_query.rsplit("```", 1)[0]
-    sql_query = sql_query.strip()
+        # Clean up query (remove markdown code blocks if present)
+        if sql_query.startswith("```"):
+            sql_query = sql_query.split("\n", 1)[1]
+        if sql_query.endswith("```"):
+            sql_query = sql_query.rsplit("```", 1)[0]
+        sql_query = sql_query.strip()
+    generated_sql = sql_query
 
-    # Safety check
-    sql_upper = sql_query.upper()
-    if any(keyword in sql_upper for keyword in ["INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE"]):
+    # Safety check: parse, allow only SELECT on work_results_n, cap LIMIT
+    try:
+        guarded = guard_sql(sql_query)
+    except SQLRejected as e:
+        if e.kind == "union":
+            # UNION causes type conflicts in ClickHouse
+            answer = "❌ Задайте конкретный вопрос:\n• Сколько просмотров за неделю?\n• Топ 5 регионов\n• Средний результат по математике"
+        else:
+            answer = "❌ Извините, этот запрос не разрешён."
+        logger.warning("Q&A SQL rejected | SQL: %s | Reason: %s", sql_query.replace("\n", " "), e)
         return QAResult(
-            answer="❌ Извините, этот запрос не разрешён.",
+            answer=answer,
             success=False,
             generated_sql=sql_query,
-            error_message="Unsafe SQL keywords detected",
+            error_message=str(e),
             input_tokens=total_input,
             output_tokens=total_output,
+            cached_input_tokens=total_cached,
+            sql_cache_hit=sql_cache_hit,
+            history_tokens_saved=history_tokens_saved,
         )
+    sql_query = guarded.sql
+    watermark = await _current_watermark()
 
-    # Block UNION - causes type conflicts in ClickHouse
-    if "UNION" in sql_upper:
+    # A result already cached for this query needs no cost check; one the
+    # preflight narrows is cached under its rewritten SQL and found below
+    lookup_start = _time.monotonic()
+    cached_results = qa_result_cache.get(sql_query, watermark=watermark)
+    try:
+        if cached_results is not None:
+            preflight = Preflight(sql=sql_query, estimate=None)
+        else:
+            # Check what the query would read; refuse or narrow full-history scans
+            preflight = await preflight_query(sql_query)
+    except QueryTooExpensive as e:
+        logger.warning("Q&A SQL refused | SQL: %s | Reason: %s", sql_query.replace("\n", " "), e)
         return QAResult(
-            answer="❌ Задайте конкретный вопрос:\n• Сколько просмотров за неделю?\n• Топ 5 регионов\n• Средний результат по математике",
+            answer="❌ Запрос затрагивает слишком много данных. Уточните период "
+                   "(например, «за последнюю неделю») или сузьте вопрос.",
             success=False,
             generated_sql=sql_query,
-            error_message="UNION queries not supported",
+            error_message=str(e),
             input_tokens=total_input,
             output_tokens=total_output,
+            cached_input_tokens=total_cached,
+            sql_cache_hit=sql_cache_hit,
+            history_tokens_saved=history_tokens_saved,
+            **_estimate_fields(e.estimate),
         )
+    sql_query = preflight.sql
+    estimate_fields = _estimate_fields(preflight.estimate)
 
-    # Auto-add LIMIT to prevent huge result sets
-    if "LIMIT" not in sql_upper:
-        sql_query = sql_query.rstrip(";") + " LIMIT 100"
+    async def execute(sql: str):
+        return await execute_query_columnar_async(
+            sql, timeout=QA_MAX_EXECUTION_TIME, settings=guarded.settings,
+        )
 
     # Step 2: Execute query
-    query_start = _time.monotonic()
+    query_start = lookup_start if cached_results is not None else _time.monotonic()
     try:
-        results = execute_query(sql_query)
+        if cached_results is not None:
+            results, sql_result_cached = cached_results, True
+        else:
+            results, sql_result_cached = await qa_result_cache.get_or_execute(
+                sql_query, execute, watermark=watermark,
+            )
         sql_execution_time_ms = int((_time.monotonic() - query_start) * 1000)
         logger.info(
-            "Q&A Query executed | Question: %s | SQL: %s | Rows returned: %d",
+            "Q&A Query executed | Question: %s | SQL: %s | Rows returned: %d | "
+            "SQL cache hit: %s | Result cached: %s",
             question,
             sql_query.replace("\n", " "),
-            len(results),
+            results.num_rows,
+            sql_cache_hit,
+            sql_result_cached,
         )
+        if sql_cache is not None and not sql_cache_hit:
+            await _store_cached_sql(sql_cache, question, today, generated_sql)
     except Exception as e:
         sql_execution_time_ms = int((_time.monotonic() - query_start) * 1000)
         logger.error(
@@ -215,29 +361,57 @@ def answer_question(question: str, user_id: int, store: ConversationStore) -> QA
             sql_execution_time_ms=sql_execution_time_ms,
             input_tokens=total_input,
             output_tokens=total_output,
+            cached_input_tokens=total_cached,
+            sql_cache_hit=sql_cache_hit,
+            history_tokens_saved=history_tokens_saved,
+            date_window_days=preflight.date_window_days,
+            **estimate_fields,
         )
 
-    # Step 3: Generate answer (truncate large result sets to stay within token limits)
-    MAX_ROWS = 100
-    if not results:
+    # Step 3: Generate answer (compact TSV, cut to the result token budget)
+    result_tokens_saved = 0
+    if not results.num_rows:
         results_text = "Нет данных"
-    elif len(results) > MAX_ROWS:
-        results_text = (
-            str(results[:MAX_ROWS])
-            + f"\n... (показано {MAX_ROWS} из {len(results)} строк)"
-        )
     else:
-        results_text = str(results)
-    # Hard cap on character length (~50K chars ≈ ~15K tokens)
-    if len(results_text) > 50_000:
-        results_text = results_text[:50_000] + "\n... (результат обрезан)"
-    answer_messages = _build_answer_messages(exchanges, question, results_text)
+        serialized = serialize_result(results, max_rows=MAX_ROWS)
+        results_text = serialized.text
+        result_tokens = serialized.tokens
+        if serialized.rows_included < serialized.total_rows:
+            # Too big to show in full: describe all rows instead of cutting them off
+            results_text = summarize_result(results)
+            result_tokens = count_tokens(results_text)
+        result_tokens_saved = serialized.legacy_tokens - result_tokens
+        logger.info(
+            "Q&A result serialized | Rows: %d | Summarized: %s | Tokens: %d | Saved vs repr: %d",
+            serialized.total_rows,
+            serialized.rows_included < serialized.total_rows,
+            result_tokens,
+            result_tokens_saved,
+        )
+    if preflight.date_window_days is not None:
+        results_text += (
+            f"\n\nПримечание: вопрос не был ограничен по времени, поэтому запрос выполнен только "
+            f"за последние {preflight.date_window_days} дней. Обязательно упомяни это в ответе."
+        )
+    answer_messages, answer_history_saved = _build_answer_messages(exchanges, question, results_text)
+    history_tokens_saved += answer_history_saved
+    if exchanges:
+        logger.info(
+            "Q&A history | Exchanges: %d | Tokens saved vs full replay: %d",
+            len(exchanges), history_tokens_saved,
+        )
 
-    answer_response = chat(messages=answer_messages, system=ANSWER_SYSTEM_PROMPT)
+    if on_answer_delta is not None:
+        answer_response = await chat_stream(
+            messages=answer_messages, on_delta=on_answer_delta, system=ANSWER_SYSTEM_PROMPT,
+        )
+    else:
+        answer_response = await chat_async(messages=answer_messages, system=ANSWER_SYSTEM_PROMPT)
 
     answer = answer_response.text
     total_input += answer_response.input_tokens
     total_output += answer_response.output_tokens
+    total_cached += answer_response.cached_input_tokens
 
     # Store the exchange for future context
     store.add_exchange(user_id, question, sql_query, answer)
@@ -249,4 +423,11 @@ def answer_question(question: str, user_id: int, store: ConversationStore) -> QA
         sql_execution_time_ms=sql_execution_time_ms,
         input_tokens=total_input,
         output_tokens=total_output,
+        cached_input_tokens=total_cached,
+        sql_cache_hit=sql_cache_hit,
+        sql_result_cached=sql_result_cached,
+        history_tokens_saved=history_tokens_saved,
+        result_tokens_saved=result_tokens_saved,
+        date_window_days=preflight.date_window_days,
+        **estimate_fields,
     )
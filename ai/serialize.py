@@ -0,0 +1,94 @@
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+
+from ai.tokens import count_tokens
+from queries.base import ColumnarResult
+
+RESULT_TOKEN_BUDGET = int(os.getenv("QA_RESULT_TOKEN_BUDGET", "4000"))
+MAX_CELL_CHARS = int(os.getenv("QA_RESULT_MAX_CELL_CHARS", "80"))
+FLOAT_DIGITS = 2
+
+# What the answer prompt used to contain: repr of the first 100 rows, cut at 50K chars
+_LEGACY_MAX_ROWS = 100
+_LEGACY_MAX_CHARS = 50_000
+
+
+@dataclass
+class SerializedResult:
+    text: str
+    tokens: int
+    rows_included: int
+    total_rows: int
+    legacy_tokens: int  # tokens the old str(list of dicts) format would have used
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.legacy_tokens - self.tokens
+
+
+def format_value(value) -> str:
+    """Compact, single-line text for one cell."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (float, Decimal)):
+        value = round(float(value), FLOAT_DIGITS)
+        return str(int(value)) if value.is_integer() else str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    text = str(value).replace("\t", " ").replace("\n", " ")
+    if len(text) > MAX_CELL_CHARS:
+        text = text[:MAX_CELL_CHARS - 1] + "…"
+    return text
+
+
+def _legacy_tokens(result: ColumnarResult) -> int:
+    text = str(result.to_dicts(limit=_LEGACY_MAX_ROWS))
+    return count_tokens(text[:_LEGACY_MAX_CHARS])
+
+
+def serialize_result(
+    result: ColumnarResult,
+    budget: int = RESULT_TOKEN_BUDGET,
+    max_rows: int | None = None,
+) -> SerializedResult:
+    """Render a result as TSV with the header once, within a token budget.
+
+    Rows are added in order until the next one would exceed `budget`
+    tokens (or `max_rows` is reached); a footer then says how many rows
+    were shown out of the total.
+    """
+    total_rows = result.num_rows
+    header = "\t".join(result.column_names)
+    lines = [header]
+    tokens = count_tokens(header) + 1
+    # Room for the truncation footer
+    reserve = 20
+
+    included = 0
+    for row in result.rows():
+        if max_rows is not None and included >= max_rows:
+            break
+        line = "\t".join(format_value(v) for v in row)
+        line_tokens = count_tokens(line) + 1
+        if tokens + line_tokens > budget - reserve:
+            break
+        lines.append(line)
+        tokens += line_tokens
+        included += 1
+
+    if included < total_rows:
+        footer = f"... (показано {included} из {total_rows} строк)"
+        lines.append(footer)
+        tokens += count_tokens(footer)
+
+    return SerializedResult(
+        text="\n".join(lines),
+        tokens=tokens,
+        rows_included=included,
+        total_rows=total_rows,
+        legacy_tokens=_legacy_tokens(result),
+    )
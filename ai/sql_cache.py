@@ -0,0 +1,136 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", ".cache/sql_cache.sqlite3")
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000"))
+SQL_CACHE_TTL_DAYS = float(os.getenv("SQL_CACHE_TTL_DAYS", "30"))
+
+# Literal dates or years make generated SQL valid only for the day it was written
+_DATE_LITERAL_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+
+
+def normalize_question(question: str) -> str:
+    """Canonical form of a question for cache lookups."""
+    text = question.lower().replace("ё", "е")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ")
+
+
+def fingerprint(*parts: str) -> str:
+    """Hash of everything that shapes the generated SQL (schema, prompt, model)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class SQLCache:
+    """Persistent question -> generated SQL cache in a local SQLite file.
+
+    Entries are keyed by the normalized question, the prompt/schema
+    fingerprint and a date context. SQL that relies on relative dates
+    (today(), now()) is stored without a date so it can be reused on later
+    days; SQL with literal dates or years only matches on the same day.
+    Rows from other fingerprints are purged on open, so changing
+    DATABASE_SCHEMA or the prompt invalidates the cache.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fingerprint: str,
+        max_entries: int = SQL_CACHE_MAX_ENTRIES,
+        ttl_days: float = SQL_CACHE_TTL_DAYS,
+    ):
+        self._fingerprint = fingerprint
+        self._max_entries = max_entries
+        self._ttl = ttl_days * 86400
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sql_cache (
+                    fingerprint TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    date_context TEXT NOT NULL,
+                    sql TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fingerprint, question, date_context)
+                )
+                """
+            )
+            purged = self._conn.execute(
+                "DELETE FROM sql_cache WHERE fingerprint != ? OR created_at < ?",
+                (fingerprint, time.time() - self._ttl),
+            ).rowcount
+        if purged:
+            logger.info("SQL cache: purged %d stale entries", purged)
+
+    def get(self, question: str, today: str) -> str | None:
+        """Return cached SQL for the question, or None."""
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                """
+                SELECT sql, date_context FROM sql_cache
+                WHERE fingerprint = ? AND question = ? AND date_context IN (?, '')
+                  AND created_at >= ?
+                ORDER BY date_context DESC
+                LIMIT 1
+                """,
+                (self._fingerprint, key, today, now - self._ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                """
+                UPDATE sql_cache SET last_used = ?, hits = hits + 1
+                WHERE fingerprint = ? AND question = ? AND date_context = ?
+                """,
+                (now, self._fingerprint, key, row[1]),
+            )
+        return row[0]
+
+    def put(self, question: str, today: str, sql: str) -> None:
+        """Store SQL generated for the question, evicting least recently used entries."""
+        date_context = today if _DATE_LITERAL_RE.search(sql) else ""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO sql_cache
+                    (fingerprint, question, date_context, sql, created_at, last_used, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+                """,
+                (self._fingerprint, normalize_question(question), date_context, sql, now, now),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM sql_cache WHERE rowid IN (
+                    SELECT rowid FROM sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self._max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, hits = self._conn.execute(
+                "SELECT count(*), coalesce(sum(hits), 0) FROM sql_cache"
+            ).fetchone()
+        return {"entries": entries, "hits": hits}
@@ -0,0 +1,167 @@
+import os
+import re
+from dataclasses import dataclass, field
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# The only table generated queries may read, in the connection's database
+ALLOWED_TABLE = "work_results_n"
+CLICKHOUSE_DATABASE = os.getenv("CLICKHOUSE_DATABASE", "default")
+
+# Outer LIMIT for generated queries; a larger or missing one is replaced
+QA_ROW_LIMIT = int(os.getenv("QA_ROW_LIMIT", "100000"))
+QA_MAX_EXECUTION_TIME = int(os.getenv("QA_MAX_EXECUTION_TIME", "30"))
+QA_MAX_ROWS_TO_READ = int(os.getenv("QA_MAX_ROWS_TO_READ", "500000000"))
+QA_MAX_MEMORY_USAGE = int(os.getenv("QA_MAX_MEMORY_USAGE", str(4 * 1024 ** 3)))
+
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Alter, exp.Create, exp.Command,
+)
+_SET_OPERATIONS = (exp.Union, exp.Intersect, exp.Except)
+# Final "LIMIT m [OFFSET k]" of a query; sqlglot cannot parse it after a
+# "LIMIT n BY ..." clause, so it is split off and re-applied
+_TRAILING_LIMIT_RE = re.compile(r"\s+LIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?\s*;?\s*$", re.IGNORECASE)
+
+
+class SQLRejected(Exception):
+    """Raised when generated SQL is not a plain SELECT we are willing to run.
+
+    `kind` is "union" for set operations (ClickHouse type conflicts, the
+    model should just ask a narrower question) and "unsafe" otherwise.
+    """
+
+    def __init__(self, message: str, kind: str = "unsafe"):
+        super().__init__(message)
+        self.kind = kind
+
+
+@dataclass
+class GuardedQuery:
+    sql: str
+    settings: dict = field(default_factory=dict)
+    limit_applied: bool = False
+
+
+def query_settings() -> dict:
+    """Per-query ClickHouse limits attached to every generated query."""
+    return {
+        # readonly=2 rather than 1: both forbid writes and DDL, but 1 would
+        # also reject the limits below, which travel as settings of the
+        # same request
+        "readonly": 2,
+        "max_execution_time": QA_MAX_EXECUTION_TIME,
+        "max_rows_to_read": QA_MAX_ROWS_TO_READ,
+        "max_result_rows": QA_ROW_LIMIT,
+        "max_memory_usage": QA_MAX_MEMORY_USAGE,
+    }
+
+
+def _check_tables(tree: exp.Expression) -> None:
+    cte_names = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    for table in tree.find_all(exp.Table):
+        if not isinstance(table.this, exp.Identifier):
+            raise SQLRejected(f"Table functions are not allowed: {table.sql(dialect='clickhouse')}")
+        if not table.db and table.name in cte_names:
+            continue
+        if table.name != ALLOWED_TABLE or table.db not in ("", CLICKHOUSE_DATABASE):
+            raise SQLRejected(f"Table not allowed: {table.sql(dialect='clickhouse')}")
+
+
+def _apply_limit(
+    tree: exp.Select, row_limit: int, outer: tuple[int, int | None] | None = None,
+) -> tuple[exp.Select, bool]:
+    """Make the outer LIMIT at most row_limit. True if the query changed.
+
+    `outer` is a (count, offset) LIMIT split off after LIMIT n BY. As
+    sqlglot keeps LIMIT n BY in the same slot as a plain LIMIT, such a
+    query is wrapped as SELECT * FROM (<query>) LIMIT m to cap its rows.
+    """
+    limit = tree.args.get("limit")
+    if outer is not None or (limit is not None and limit.expressions):
+        wrapped = exp.select("*").from_(tree.subquery(copy=False))
+        if outer is None:
+            return wrapped.limit(row_limit, copy=False), True
+        count, offset = outer
+        wrapped.limit(min(count, row_limit), copy=False)
+        if offset:
+            wrapped.offset(offset, copy=False)
+        return wrapped, count > row_limit
+    if limit is not None:
+        value = limit.expression
+        if isinstance(value, exp.Literal) and value.is_int and int(value.name) <= row_limit:
+            return tree, False
+    tree.limit(row_limit, copy=False)
+    return tree, True
+
+
+def _parse(sql: str) -> list[exp.Expression]:
+    return [s for s in sqlglot.parse(sql, read="clickhouse") if s is not None]
+
+
+def guard_sql(sql: str, row_limit: int = QA_ROW_LIMIT) -> GuardedQuery:
+    """Parse generated SQL, reject anything but a SELECT on ALLOWED_TABLE,
+    cap its outer LIMIT and return it with the ClickHouse limits to send.
+
+    Raises SQLRejected if the query does not parse or is not allowed.
+    """
+    outer_limit = None
+    try:
+        statements = _parse(sql)
+    except SqlglotError as e:
+        match = _TRAILING_LIMIT_RE.search(sql)
+        try:
+            if match is None:
+                raise e
+            # Possibly "... LIMIT n BY x LIMIT m": parse without the last LIMIT
+            statements = _parse(sql[:match.start()])
+        except SqlglotError:
+            raise SQLRejected(f"Could not parse SQL: {e}") from None
+        outer_limit = (int(match[1]), int(match[2]) if match[2] else None)
+    if len(statements) != 1:
+        raise SQLRejected("Exactly one statement expected")
+
+    tree = statements[0]
+    if isinstance(tree, _SET_OPERATIONS) or tree.find(*_SET_OPERATIONS):
+        raise SQLRejected("UNION queries not supported", kind="union")
+    if not isinstance(tree, exp.Select):
+        raise SQLRejected(f"Only SELECT is allowed, got {tree.key.upper()}")
+    if tree.find(*_FORBIDDEN_NODES):
+        raise SQLRejected("Unsafe SQL statement detected")
+    # A SETTINGS clause could lift the limits we attach (also from a
+    # subquery), and FORMAT would break result decoding
+    if any(select.args.get("settings") or select.args.get("format") for select in tree.find_all(exp.Select)):
+        raise SQLRejected("SETTINGS and FORMAT clauses are not allowed")
+    _check_tables(tree)
+    if outer_limit is not None and not (tree.args.get("limit") and tree.args["limit"].expressions):
+        raise SQLRejected("Could not parse SQL: multiple LIMIT clauses")
+
+    tree, limit_applied = _apply_limit(tree, row_limit, outer_limit)
+    return GuardedQuery(
+        sql=tree.sql(dialect="clickhouse"),
+        settings=query_settings(),
+        limit_applied=limit_applied,
+    )
+
+
+def has_date_filter(sql: str) -> bool:
+    """True if any WHERE/PREWHERE in the query mentions submission_date."""
+    tree = sqlglot.parse_one(sql, read="clickhouse")
+    return any(
+        column.name == "submission_date"
+        for where in tree.find_all(exp.Where, exp.PreWhere)
+        for column in where.find_all(exp.Column)
+    )
+
+
+def add_date_window(sql: str, days: int) -> str:
+    """Restrict every read of ALLOWED_TABLE to the last `days` days."""
+    tree = sqlglot.parse_one(sql, read="clickhouse")
+    for table in tree.find_all(exp.Table):
+        if table.name != ALLOWED_TABLE:
+            continue
+        select = table.find_ancestor(exp.Select)
+        condition = f"toDate({table.alias_or_name}.submission_date) >= today() - {int(days)}"
+        select.where(condition, dialect="clickhouse", copy=False)
+    return tree.sql(dialect="clickhouse")
@@ -0,0 +1,114 @@
+import os
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+
+from ai.serialize import RESULT_TOKEN_BUDGET, format_value, serialize_result
+from ai.tokens import count_tokens
+from queries.base import ColumnarResult
+
+SUMMARY_SAMPLE_ROWS = int(os.getenv("QA_SUMMARY_SAMPLE_ROWS", "20"))
+SUMMARY_TOP_K = int(os.getenv("QA_SUMMARY_TOP_K", "5"))
+
+
+def _numeric(values: np.ndarray) -> str:
+    values = values.astype(float)
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return "число, нет значений"
+    p25, p50, p75 = np.percentile(values, [25, 50, 75])
+    stats = {
+        "count": values.size,
+        "sum": values.sum(),
+        "min": values.min(),
+        "p25": p25,
+        "median": p50,
+        "p75": p75,
+        "max": values.max(),
+        "mean": values.mean(),
+    }
+    return "число, " + ", ".join(f"{k}={format_value(v)}" for k, v in stats.items())
+
+
+def _dates(values: np.ndarray) -> str:
+    days = values.astype("datetime64[D]")
+    return (
+        f"дата, count={days.size}, min={days.min()}, max={days.max()}, "
+        f"distinct={np.unique(days).size}"
+    )
+
+
+def _categorical(values: np.ndarray, top_k: int) -> str:
+    labels, counts = np.unique(values.astype(str), return_counts=True)
+    order = np.argsort(counts)[::-1][:top_k]
+    top = ", ".join(f"{format_value(labels[i])} ({counts[i]})" for i in order)
+    return f"текст, count={values.size}, distinct={labels.size}, top: {top}"
+
+
+def _to_array(column) -> np.ndarray:
+    """One array element per cell. np.asarray would turn Array/Tuple cells
+    into extra dimensions (or fail on ragged ones)."""
+    if isinstance(column, np.ndarray) and column.ndim == 1:
+        return column
+    values = np.empty(len(column), dtype=object)
+    for i, value in enumerate(column):
+        values[i] = value
+    return values
+
+
+def describe_column(column, top_k: int = SUMMARY_TOP_K) -> str:
+    """One-line description of a column computed over all of its values."""
+    values = _to_array(column)
+    if values.dtype.kind == "O":
+        present = values[np.array([v is not None for v in values], dtype=bool)]
+        if not present.size:
+            return "нет значений"
+        first = present[0]
+        if isinstance(first, (list, tuple, dict, set)):
+            # Array/Tuple/Map cells: counted as whole values
+            return _categorical(np.array([str(v) for v in present]), top_k)
+        if isinstance(first, date):
+            return _dates(present)
+        if isinstance(first, (int, float, Decimal, np.number)) and not isinstance(first, bool):
+            try:
+                return _numeric(present)
+            except (TypeError, ValueError):
+                pass  # mixed column; described by its string forms below
+        return _categorical(np.array([str(v) for v in present]), top_k)
+    if values.dtype.kind in "iuf":
+        return _numeric(values)
+    if values.dtype.kind == "M":
+        return _dates(values)
+    return _categorical(values, top_k)
+
+
+def _sample_indices(num_rows: int, sample_rows: int) -> np.ndarray:
+    """First rows (the query's own ordering usually puts the most relevant
+    ones there) plus rows evenly spread over the rest."""
+    if num_rows <= sample_rows:
+        return np.arange(num_rows)
+    head = min(num_rows, sample_rows // 2)
+    spread = np.linspace(head, num_rows - 1, sample_rows - head).astype(int)
+    return np.unique(np.concatenate([np.arange(head), spread]))
+
+
+def summarize_result(
+    result: ColumnarResult,
+    budget: int = RESULT_TOKEN_BUDGET,
+    sample_rows: int = SUMMARY_SAMPLE_ROWS,
+) -> str:
+    """Describe every row of a large result: per-column stats plus a sample."""
+    lines = [f"Результат слишком большой, чтобы показать целиком: {result.num_rows} строк.", "Статистика по всем строкам:"]
+    for name, column in zip(result.column_names, result.columns):
+        lines.append(f"- {name}: {describe_column(column)}")
+
+    indices = _sample_indices(result.num_rows, sample_rows)
+    sample = ColumnarResult(
+        result.column_names,
+        tuple([column[i] for i in indices] for column in result.columns),
+    )
+    stats_text = "\n".join(lines)
+    remaining = max(budget - count_tokens(stats_text), 200)
+    sample_text = serialize_result(sample, budget=remaining).text
+    return f"{stats_text}\n\nПримеры строк ({len(indices)} из {result.num_rows}):\n{sample_text}"
@@ -0,0 +1,34 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """Lazy initialization of the tiktoken encoding. None if unavailable."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning("tiktoken unavailable, using approximate token counts: %s", e)
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens locally.
+
+    Exact for OpenAI models when tiktoken is available; otherwise (and for
+    Anthropic) an estimate of one token per ~4 UTF-8 bytes, which also holds
+    reasonably for Cyrillic text.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text.encode("utf-8")) + 3) // 4
@@ -0,0 +1,104 @@
+"""Compare the per-metric report queries with the consolidated single scan.
+
+Runs each collection strategy against the configured ClickHouse and prints
+query count, rows/bytes read (from X-ClickHouse-Summary) and wall time, then
+checks that they all produce the same metrics. The local rollup is synced
+before it is measured, so its numbers are for reads only.
+
+Usage: python -m benchmarks.activity_metrics [YYYY-MM-DD] [--repeat N]
+"""
+import sys
+import time
+import asyncio
+import argparse
+from datetime import date, timedelta
+
+from queries.base import get_query_stats, warm_up
+from queries.rollup import get_rollup_store
+from queries.activity import (
+    get_consolidated_activity_metrics,
+    get_parallel_activity_metrics,
+    get_daily_activity,
+    get_weekly_submission_trend,
+    get_weekly_comparison,
+    get_submissions_by_parallel,
+    get_submissions_by_work_type,
+    get_top_active_schools,
+    get_top_active_regions,
+    get_status_breakdown,
+)
+
+
+async def collect_per_query(target_date: date) -> dict:
+    """The original report path: one query per metric."""
+    return {
+        "activity_today": await get_daily_activity(target_date),
+        "activity_yesterday": await get_daily_activity(target_date - timedelta(days=1)),
+        "weekly_trend": await get_weekly_submission_trend(target_date),
+        "weekly_comparison": await get_weekly_comparison(target_date),
+        "by_parallel": await get_submissions_by_parallel(target_date),
+        "by_work_type": await get_submissions_by_work_type(target_date),
+        "top_schools": await get_top_active_schools(target_date),
+        "top_regions": await get_top_active_regions(target_date),
+        "status_breakdown": await get_status_breakdown(target_date),
+    }
+
+
+async def measure(label: str, collect, target_date: date, repeat: int) -> dict:
+    stats_before = get_query_stats()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        metrics = await collect(target_date)
+    elapsed = (time.perf_counter() - start) / repeat
+    stats_after = get_query_stats()
+
+    queries = (stats_after["queries"] - stats_before["queries"]) // repeat
+    read_rows = (stats_after["read_rows"] - stats_before["read_rows"]) // repeat
+    read_bytes = (stats_after["read_bytes"] - stats_before["read_bytes"]) // repeat
+    print(
+        f"{label:<14} queries={queries:<3} read_rows={read_rows:>12,} "
+        f"read_bytes={read_bytes:>14,} wall={elapsed * 1000:>8.1f} ms"
+    )
+    return metrics
+
+
+def _normalize(metrics: dict) -> dict:
+    """Make top-N lists comparable regardless of tie order."""
+    normalized = {k: v for k, v in metrics.items() if k not in ("missing", "timings_ms")}
+    for key in ("by_work_type", "top_schools", "top_regions", "status_breakdown"):
+        normalized[key] = sorted(metrics[key], key=lambda r: sorted(map(str, r.items())))
+    return normalized
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("date", nargs="?", type=date.fromisoformat,
+                        default=date.today() - timedelta(days=1))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    warm_up()
+    print(f"Report date: {args.date}, averaged over {args.repeat} run(s)")
+    before = await measure("per-query", collect_per_query, args.date, args.repeat)
+    results = {
+        "parallel": await measure("parallel", get_parallel_activity_metrics, args.date, args.repeat),
+        "consolidated": await measure("consolidated", get_consolidated_activity_metrics, args.date, args.repeat),
+    }
+    await get_rollup_store().sync(since=args.date - timedelta(days=args.date.weekday() + 7))
+    results["rollup"] = await measure("rollup", get_rollup_store().get_activity_metrics, args.date, args.repeat)
+
+    status = 0
+    expected = _normalize(before)
+    for label, metrics in results.items():
+        actual = _normalize(metrics)
+        for key in expected:
+            if expected[key] != actual[key]:
+                print(f"MISMATCH in {label} {key}:\n  per-query: {expected[key]}\n  {label}: {actual[key]}")
+                status = 1
+    if status == 0:
+        print("Results match")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,56 @@
+"""Compare row-dict and columnar result decoding on a large result set.
+
+Runs the same synthetic query through execute_query (list of dicts) and
+execute_query_columnar, and prints wall time and peak Python memory for each.
+
+Usage: python -m benchmarks.columnar_results [--rows N] [--repeat N]
+"""
+import sys
+import time
+import argparse
+import tracemalloc
+
+from queries.base import execute_query, execute_query_columnar, warm_up
+
+QUERY = """
+SELECT
+    number AS id,
+    concat('Школа №', toString(number % 5000)) AS school,
+    concat('Регион ', toString(number % 85)) AS region,
+    toUInt32(number % 101) AS result_percent,
+    number * 1.5 AS score,
+    today() - toIntervalDay(number % 30) AS day
+FROM numbers({rows})
+"""
+
+
+def measure(label: str, run, repeat: int) -> None:
+    elapsed = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = run()
+        elapsed.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del result
+    print(f"{label:<10} best={min(elapsed) * 1000:>8.1f} ms  peak_mem={peak / 1024 / 1024:>7.1f} MiB")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    warm_up()
+    query = QUERY.format(rows=args.rows)
+    print(f"{args.rows:,} rows, best of {args.repeat}")
+    measure("dicts", lambda: execute_query(query), args.repeat)
+    measure("columnar", lambda: execute_query_columnar(query), args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+QA_MAX_CONCURRENT_REQUESTS = int(os.getenv("QA_MAX_CONCURRENT_REQUESTS", "4"))
+# Pending questions per user before new ones are merged into the last one
+QA_MAX_QUEUED_PER_USER = int(os.getenv("QA_MAX_QUEUED_PER_USER", "3"))
+# Pending questions overall before new ones are rejected
+QA_MAX_QUEUED_TOTAL = int(os.getenv("QA_MAX_QUEUED_TOTAL", "100"))
+# Seconds to let accepted requests finish on shutdown
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+# Samples kept for the wait/service time percentiles
+_SAMPLES = 500
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the global queue is full."""
+
+
+@dataclass
+class _Job:
+    texts: list[str]
+    run: Callable[[str], Awaitable[None]]
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class Submitted:
+    position: int  # 1-based place among waiting questions; 0 = started now
+    merged: bool = False  # appended to the user's last pending question
+
+
+def _percentile(samples: deque, q: float) -> int:
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return int(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000)
+
+
+class RequestScheduler:
+    """Fair admission control for Q&A requests.
+
+    Each user's questions run one at a time, in order, so a user's
+    follow-ups see the history of the previous ones. At most
+    `max_concurrent` questions run overall; when more are waiting, users
+    take turns round-robin, so one user's burst cannot starve the rest.
+    A user with `max_per_user` questions already waiting has new ones
+    merged into the last waiting question; once `max_total` questions are
+    waiting overall, new ones are rejected with QueueFull.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = QA_MAX_CONCURRENT_REQUESTS,
+        max_per_user: int = QA_MAX_QUEUED_PER_USER,
+        max_total: int = QA_MAX_QUEUED_TOTAL,
+    ):
+        self._max_concurrent = max_concurrent
+        self._max_per_user = max_per_user
+        self._max_total = max_total
+        self._queues: dict[int, deque[_Job]] = {}
+        # Users with waiting jobs and nothing running, in round-robin order
+        self._ready: deque[int] = deque()
+        self._running: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._pending = 0
+        self._wait_times: deque[float] = deque(maxlen=_SAMPLES)
+        self._service_times: deque[float] = deque(maxlen=_SAMPLES)
+        self.completed = 0
+        self.failed = 0
+        self.merged = 0
+        self.rejected = 0
+
+    def submit(self, user_id: int, text: str, run: Callable[[str], Awaitable[None]]) -> Submitted:
+        """Queue run(text) for user_id and start it as soon as it is its turn."""
+        queue = self._queues.get(user_id)
+        if queue and len(queue) >= self._max_per_user:
+            queue[-1].texts.append(text)
+            self.merged += 1
+            return Submitted(position=self._position(user_id, len(queue) - 1), merged=True)
+        if self._pending >= self._max_total:
+            self.rejected += 1
+            raise QueueFull(f"{self._pending} requests already waiting")
+
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+        job = _Job([text], run)
+        queue.append(job)
+        self._pending += 1
+        if user_id not in self._running and len(queue) == 1:
+            self._ready.append(user_id)
+        self._dispatch()
+        if not any(j is job for j in queue):
+            return Submitted(position=0)
+        return Submitted(position=self._position(user_id, len(queue) - 1))
+
+    def _position(self, user_id: int, index: int) -> int:
+        """1-based place of the user's index-th waiting job among all waiting jobs.
+
+        Follows the round-robin order: every round each waiting user starts
+        one job. Users with a running job are placed after the ready ones,
+        which is where they rejoin once it finishes.
+        """
+        order = list(self._ready) + [
+            u for u in self._running if self._queues.get(u) and u not in self._ready
+        ]
+        place = 0
+        for round_ in range(index + 1):
+            for other in order:
+                if len(self._queues[other]) > round_:
+                    place += 1
+                    if other == user_id and round_ == index:
+                        return place
+        return place
+
+    def _dispatch(self) -> None:
+        while self._ready and len(self._running) < self._max_concurrent:
+            user_id = self._ready.popleft()
+            job = self._queues[user_id].popleft()
+            self._pending -= 1
+            self._running.add(user_id)
+            task = asyncio.create_task(self._execute(user_id, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, user_id: int, job: _Job) -> None:
+        started = time.monotonic()
+        self._wait_times.append(started - job.enqueued_at)
+        try:
+            await job.run("\n".join(job.texts))
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Q&A request for user %s failed", user_id)
+        finally:
+            finished = time.monotonic()
+            self._service_times.append(finished - started)
+            logger.info(
+                "Q&A request for user %s | Waited: %d ms | Served in: %d ms",
+                user_id, (started - job.enqueued_at) * 1000, (finished - started) * 1000,
+            )
+            self._running.discard(user_id)
+            if self._queues.get(user_id):
+                self._ready.append(user_id)
+            else:
+                self._queues.pop(user_id, None)
+            self._dispatch()
+
+    async def drain(self, timeout: float | None = None) -> bool:
+        """Wait until nothing is queued or running; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._tasks or self._pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(set(self._tasks), timeout=remaining)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._running),
+            "queued": self._pending,
+            "waiting_users": len(self._ready),
+            "completed": self.completed,
+            "failed": self.failed,
+            "merged": self.merged,
+            "rejected": self.rejected,
+            "wait_ms_p50": _percentile(self._wait_times, 0.5),
+            "wait_ms_p95": _percentile(self._wait_times, 0.95),
+            "service_ms_p50": _percentile(self._service_times, 0.5),
+            "service_ms_p95": _percentile(self._service_times, 0.95),
+        }
@@ -1,13 +1,18 @@
 import os
+import time
+import asyncio
 import logging
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from conversation import ConversationStore
+from conversation_backends import create_backend
+from bot.queue import QueueFull, RequestScheduler
 
 load_dotenv()
 
@@ -15,6 +20,14 @@ logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Minimum seconds between edits of a streamed message (Telegram allows ~1/s per chat)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# /stat: users per page, latest questions shown per user and their max length
+STAT_PAGE_SIZE = int(os.getenv("STAT_PAGE_SIZE", "10"))
+STAT_QUESTIONS_PER_USER = int(os.getenv("STAT_QUESTIONS_PER_USER", "5"))
+STAT_QUESTION_CHARS = 120
+
 # Parse chat IDs from comma-separated list
 _chat_ids_str = os.getenv("TELEGRAM_CHAT_ID", "")
 CHAT_IDS: set[int] = set()
@@ -34,7 +47,8 @@ if _admin_users_str.strip():
     ADMIN_USERS = {int(uid.strip()) for uid in _admin_users_str.split(",") if uid.strip()}
 
 router = Router()
-conversation_store = ConversationStore()
+conversation_store = ConversationStore(backend=create_backend())
+request_scheduler = RequestScheduler()
 
 
 def is_user_allowed(user_id: int) -> bool:
@@ -80,6 +94,73 @@ async def safe_reply(message: Message, text: str) -> None:
             await message.answer(chunk, parse_mode=None)
 
 
+class StreamingReply:
+    """Progressively edit a placeholder message as LLM text streams in.
+
+    Edits are throttled to STREAM_EDIT_INTERVAL and sent as plain text,
+    since partial Markdown rarely parses. Text longer than one Telegram
+    message continues in new messages at _split_message boundaries.
+    finish() renders the final text with Markdown, falling back to plain.
+    """
+
+    def __init__(self, placeholder: Message):
+        self._messages = [placeholder]
+        self._shown = [placeholder.text or ""]
+        self._text = ""
+        self._next_edit_at = 0.0
+
+    async def on_delta(self, delta: str) -> None:
+        self._text += delta
+        if time.monotonic() >= self._next_edit_at:
+            await self._render(parse_mode=None)
+
+    async def finish(self, text: str) -> None:
+        self._text = text
+        await self._render(parse_mode=ParseMode.MARKDOWN)
+
+    async def _render(self, parse_mode: str | None) -> None:
+        self._next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+        for i, chunk in enumerate(_split_message(self._text)):
+            if not chunk.strip():
+                continue
+            if i < len(self._messages):
+                if chunk != self._shown[i] or parse_mode is not None:
+                    await self._edit(i, chunk, parse_mode)
+            else:
+                self._messages.append(await self._send(chunk, parse_mode))
+                self._shown.append(chunk)
+
+    async def _edit(self, i: int, chunk: str, parse_mode: str | None) -> None:
+        try:
+            await self._messages[i].edit_text(chunk, parse_mode=parse_mode)
+        except TelegramRetryAfter as e:
+            self._next_edit_at = time.monotonic() + e.retry_after
+            if parse_mode is None:
+                return
+            # The final text must land, so wait out the flood limit
+            await asyncio.sleep(e.retry_after)
+            return await self._edit(i, chunk, parse_mode)
+        except TelegramBadRequest as e:
+            if "not modified" in str(e).lower():
+                pass
+            elif parse_mode is not None:
+                logger.warning("Failed to edit with Markdown: %s", e)
+                return await self._edit(i, chunk, None)
+            else:
+                logger.warning("Failed to edit streamed message: %s", e)
+                return
+        self._shown[i] = chunk
+
+    async def _send(self, chunk: str, parse_mode: str | None) -> Message:
+        try:
+            return await self._messages[0].answer(chunk, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            if parse_mode is None:
+                raise
+            logger.warning("Failed to send with Markdown: %s", e)
+            return await self._messages[0].answer(chunk, parse_mode=None)
+
+
 async def send_report(bot: Bot, report: str) -> None:
     """Send a report to all configured chats."""
     if not CHAT_IDS:
@@ -139,8 +220,9 @@ async def help_command(message: Message) -> None:
         "Команды:\n"
         "/start - Получить Chat ID\n"
         "/report - Отчёт по активности\n"
+        "/report refresh - Пересоздать отчёт\n"
         "/clear - Сбросить контекст диалога\n"
-        "/stat - Статистика использования (админ)\n"
+        "/stat [дни] [страница] - Статистика использования (админ)\n"
         "/help - Эта справка\n\n"
         "Также вы можете задать вопрос о данных в свободной форме.\n"
         "Бот помнит контекст диалога для уточняющих вопросов.",
@@ -166,92 +248,86 @@ async def stat_command(message: Message) -> None:
         await message.answer("⛔ Доступ запрещён. Команда доступна только администраторам.")
         return
 
-    # Parse days argument: /stat 7 for 7 days, /stat 0 for all time, default 30
+    # Parse arguments: /stat 7 for 7 days, /stat 0 for all time, default 30;
+    # an optional second argument selects the page of users
     args = message.text.split()
     days = 30
-    if len(args) > 1:
-        try:
+    page = 1
+    try:
+        if len(args) > 1:
             days = int(args[1])
-        except ValueError:
-            await message.answer(
-                "❌ Использование: /stat [дни]\n"
-                "Пример: /stat 7 — за 7 дней, /stat 0 — за всё время"
-            )
-            return
+        if len(args) > 2:
+            page = int(args[2])
+    except ValueError:
+        await message.answer(
+            "❌ Использование: /stat [дни] [страница]\n"
+            "Пример: /stat 7 — за 7 дней, /stat 0 — за всё время, /stat 30 2 — вторая страница"
+        )
+        return
 
     if days < 0:
         await message.answer("❌ Количество дней не может быть отрицательным.")
         return
+    if page < 1:
+        await message.answer("❌ Номер страницы начинается с 1.")
+        return
 
     await message.answer("📊 Загружаю статистику...")
 
     try:
-        from supabase_client import get_qa_stats
+        from supabase_client import get_qa_stats_totals, get_qa_user_stats, get_recent_questions
 
         since_iso = None
         if days > 0:
             since_dt = datetime.now(timezone.utc) - timedelta(days=days)
             since_iso = since_dt.isoformat()
+        period_text = f"за {days} дн." if days > 0 else "за всё время"
 
-        rows = get_qa_stats(since_iso=since_iso)
-
-        if not rows:
-            period_text = f"за {days} дн." if days > 0 else "за всё время"
+        # Aggregated in Supabase; only one page of users is fetched
+        totals = await asyncio.to_thread(get_qa_stats_totals, since_iso)
+        if not totals["requests"]:
             await message.answer(f"📊 Нет данных {period_text}.")
             return
 
-        # Aggregate per user
-        user_stats: dict[int, dict] = {}
-        for row in rows:
-            uid = row["telegram_user_id"]
-            if uid not in user_stats:
-                user_stats[uid] = {
-                    "username": row.get("telegram_username") or str(uid),
-                    "count": 0,
-                    "input_tokens": 0,
-                    "output_tokens": 0,
-                    "questions": [],
-                }
-            user_stats[uid]["count"] += 1
-            user_stats[uid]["input_tokens"] += row.get("input_tokens") or 0
-            user_stats[uid]["output_tokens"] += row.get("output_tokens") or 0
-            q = row.get("question")
-            if q:
-                user_stats[uid]["questions"].append(q)
-
-        # Sort by total tokens descending
-        sorted_users = sorted(
-            user_stats.values(),
-            key=lambda u: u["input_tokens"] + u["output_tokens"],
-            reverse=True,
+        pages = max(1, -(-totals["users"] // STAT_PAGE_SIZE))
+        if page > pages:
+            await message.answer(f"❌ Всего страниц: {pages}.")
+            return
+
+        users = await asyncio.to_thread(
+            get_qa_user_stats, since_iso, STAT_PAGE_SIZE, (page - 1) * STAT_PAGE_SIZE,
+        )
+        questions = await asyncio.to_thread(
+            get_recent_questions,
+            [u["telegram_user_id"] for u in users],
+            since_iso,
+            STAT_QUESTIONS_PER_USER,
         )
 
         # Build response
-        period_text = f"за {days} дн." if days > 0 else "за всё время"
-        lines = [f"📊 *Статистика использования* ({period_text})\n"]
-
-        total_count = 0
-        total_input = 0
-        total_output = 0
-
-        for u in sorted_users:
-            total_count += u["count"]
-            total_input += u["input_tokens"]
-            total_output += u["output_tokens"]
+        lines = [f"📊 *Статистика использования* ({period_text}), стр. {page}/{pages}\n"]
+        for u in users:
+            uid = u["telegram_user_id"]
+            user_questions = questions.get(uid, [])
             questions_list = "\n".join(
-                f"   • {q}" for q in u["questions"]
+                f"   • {q if len(q) <= STAT_QUESTION_CHARS else q[:STAT_QUESTION_CHARS - 1] + '…'}"
+                for q in user_questions
             )
+            if u["requests"] > len(user_questions):
+                questions_list += f"\n   … и ещё {u['requests'] - len(user_questions)}"
             lines.append(
-                f"👤 *{u['username']}*\n"
-                f"   Запросов: {u['count']}\n"
+                f"👤 *{u['telegram_username'] or uid}*\n"
+                f"   Запросов: {u['requests']}\n"
                 f"{questions_list}\n"
                 f"   Токены (входящие/исходящие): {u['input_tokens']:,} / {u['output_tokens']:,}\n"
             )
 
         lines.append(
-            f"📈 *Итого:* {total_count} запросов, "
-            f"токены: {total_input:,} / {total_output:,}"
+            f"📈 *Итого:* {totals['users']} польз., {totals['requests']} запросов, "
+            f"токены: {totals['input_tokens']:,} / {totals['output_tokens']:,}"
         )
+        if page < pages:
+            lines.append(f"\nСледующая страница: /stat {days} {page + 1}")
 
         await safe_reply(message, "\n".join(lines))
 
@@ -262,22 +338,29 @@ async def stat_command(message: Message) -> None:
 
 @router.message(Command("report"))
 async def report_command(message: Message) -> None:
-    """Handle /report command - generate activity report on demand."""
+    """Handle /report command - serve the stored activity report.
+
+    /report refresh regenerates it from fresh data.
+    """
     logger.info("report_command called by user %s", message.from_user.id)
 
     if not is_user_allowed(message.from_user.id):
         await message.answer("⛔ Доступ запрещён.")
         return
 
-    await message.answer("⏳ Генерирую отчёт по активности...")
+    args = message.text.split()
+    force = len(args) > 1 and args[1].lower() in ("refresh", "обновить")
 
     try:
-        from queries.activity import get_all_activity_metrics
-        from ai.insights import generate_activity_report
-
-        metrics = get_all_activity_metrics()
-        report = generate_activity_report(metrics)
-        await safe_reply(message, report)
+        from reports import report_store
+
+        if not force and (report := report_store.get_cached(date.today() - timedelta(days=1))):
+            await safe_reply(message, report)
+        else:
+            placeholder = await message.answer("⏳ Генерирую отчёт по активности...")
+            reply = StreamingReply(placeholder)
+            report = await report_store.get(force=force, on_delta=reply.on_delta)
+            await reply.finish(report)
         logger.info("Activity report sent successfully")
     except Exception as e:
         logger.exception("Error generating report: %s", e)
@@ -286,20 +369,38 @@ async def report_command(message: Message) -> None:
 
 @router.message(F.text)
 async def handle_message(message: Message) -> None:
-    """Handle free-form questions."""
+    """Handle free-form questions: queue them in the request scheduler."""
     if not is_user_allowed(message.from_user.id):
         await message.answer("⛔ Доступ запрещён.")
         return
 
-    question = message.text
-    await message.answer("🤔 Думаю...")
+    try:
+        submitted = request_scheduler.submit(
+            message.from_user.id, message.text, lambda question: _answer(message, question),
+        )
+    except QueueFull:
+        await message.answer("⏳ Сейчас слишком много вопросов. Попробуйте через пару минут.")
+        return
+
+    if submitted.merged:
+        await message.answer("➕ Добавил к вашему вопросу, который ещё ждёт в очереди.")
+    elif submitted.position:
+        await message.answer(f"⏳ Ваш вопрос в очереди: {submitted.position}-й. Отвечу, как только освободится место.")
+
+
+async def _answer(message: Message, question: str) -> None:
+    """Answer one (possibly merged) question; run by request_scheduler."""
+    placeholder = await message.answer("🤔 Думаю...")
+    reply = StreamingReply(placeholder)
 
     try:
         from ai.qa import answer_question
         from supabase_client import log_qa_exchange
 
-        result = answer_question(question, message.from_user.id, conversation_store)
-        await safe_reply(message, result.answer)
+        result = await answer_question(
+            question, message.from_user.id, conversation_store, on_answer_delta=reply.on_delta,
+        )
+        await reply.finish(result.answer)
 
         log_qa_exchange(
             telegram_user_id=message.from_user.id,
@@ -312,6 +413,15 @@ async def handle_message(message: Message) -> None:
             sql_execution_time_ms=result.sql_execution_time_ms,
             input_tokens=result.input_tokens,
             output_tokens=result.output_tokens,
+            cached_input_tokens=result.cached_input_tokens,
+            sql_cache_hit=result.sql_cache_hit,
+            sql_result_cached=result.sql_result_cached,
+            estimated_rows=result.estimated_rows,
+            estimated_parts=result.estimated_parts,
+            estimated_bytes=result.estimated_bytes,
+            date_window_days=result.date_window_days,
+            result_tokens_saved=result.result_tokens_saved,
+            history_tokens_saved=result.history_tokens_saved,
         )
     except Exception as e:
         logger.exception("Error answering question")
@@ -0,0 +1,142 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from bot.queue import SHUTDOWN_DRAIN_TIMEOUT
+from bot.telegram import conversation_store, request_scheduler
+from supabase_client import qa_log_writer
+
+logger = logging.getLogger(__name__)
+
+# Public base URL Telegram posts updates to, e.g. https://bot.example.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Updates processed at once by this replica; Q&A work itself is bounded
+# separately by the request scheduler
+WEBHOOK_MAX_CONCURRENT_UPDATES = int(os.getenv("WEBHOOK_MAX_CONCURRENT_UPDATES", "32"))
+# Parallel connections Telegram opens to the webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+HEALTH_PATH = os.getenv("HEALTH_PATH", "/healthz")
+
+
+class ConcurrencyLimit(BaseMiddleware):
+    """Outer update middleware capping how many updates are handled at once."""
+
+    def __init__(self, limit: int = WEBHOOK_MAX_CONCURRENT_UPDATES):
+        self._semaphore = asyncio.Semaphore(limit)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.in_flight = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float | None = None) -> bool:
+        """Wait until no update is being handled; False on timeout."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class _Webhook(SimpleRequestHandler):
+    """Rejects updates once draining starts, so Telegram redelivers them
+    to another replica (or to this one after a restart)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.draining = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.draining:
+            return web.Response(status=503, text="draining")
+        return await super().handle(request)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Serve updates over a webhook until SIGTERM/SIGINT, then drain.
+
+    The webhook is left registered on shutdown: with several replicas
+    behind one URL the others keep serving it, and a single replica picks
+    up the updates Telegram queued once it is back.
+    """
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set for BOT_MODE=webhook")
+
+    limiter = ConcurrencyLimit()
+    dp.update.outer_middleware(limiter)
+    # Handled inside the request, not in the background: a full limiter
+    # then holds Telegram's connection (back-pressure), and every update
+    # that got a 200 has been through the limiter, so the drain sees it
+    webhook = _Webhook(dispatcher=dp, bot=bot, handle_in_background=False, secret_token=WEBHOOK_SECRET)
+    started_at = time.monotonic()
+
+    async def health(request: web.Request) -> web.Response:
+        body = {
+            "status": "draining" if webhook.draining else "ok",
+            "uptime_s": int(time.monotonic() - started_at),
+            "updates_in_flight": limiter.in_flight,
+            "qa_requests": request_scheduler.stats(),
+            "qa_log_writer": qa_log_writer.stats(),
+            "conversations": conversation_store.stats(),
+        }
+        return web.json_response(body, status=503 if webhook.draining else 200)
+
+    app = web.Application()
+    # Registered by hand rather than with webhook.register(): that closes
+    # the bot session on shutdown, before queued answers have been sent
+    app.router.add_post(WEBHOOK_PATH, webhook.handle)
+    app.router.add_get(HEALTH_PATH, health)
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        logger.info("Shutting down webhook: draining %d update(s)", limiter.in_flight)
+        webhook.draining = True
+        if not await limiter.wait_idle(SHUTDOWN_DRAIN_TIMEOUT):
+            logger.warning("Updates still in flight after %ss", SHUTDOWN_DRAIN_TIMEOUT)
+        await runner.cleanup()
@@ -1,45 +1,302 @@
+import os
+import sys
 import time
+import heapq
+import asyncio
 import logging
+from collections import OrderedDict
+from typing import NamedTuple
+from conversation_backends import ConversationBackend
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_TTL = 1800  # 30 minutes
 DEFAULT_MAX_EXCHANGES = 10
+DEFAULT_MAX_USERS = int(os.getenv("CONVERSATION_MAX_USERS", "10000"))
+DEFAULT_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024)))
+SWEEP_INTERVAL = float(os.getenv("CONVERSATION_SWEEP_INTERVAL", "60"))
+# With a shared backend: how often queued writes are sent, and how long
+# a history read from the backend is reused before it is read again
+FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "1"))
+CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL", "5"))
+
+# Fixed cost of one exchange record and one user entry, on top of the strings
+_EXCHANGE_OVERHEAD = sys.getsizeof(("", "", ""))
+_ENTRY_OVERHEAD = 200
+
+
+class Exchange(NamedTuple):
+    """One completed question -> SQL -> answer round."""
+    question: str
+    sql: str
+    answer: str
+
+
+def _exchange_size(exchange: Exchange) -> int:
+    return _EXCHANGE_OVERHEAD + sum(sys.getsizeof(s) for s in exchange)
+
+
+class _Conversation:
+    __slots__ = ("exchanges", "expires_at", "size", "loaded_at")
+
+    def __init__(self, expires_at: float, loaded_at: float = float("-inf")):
+        self.exchanges: tuple[Exchange, ...] = ()
+        self.expires_at = expires_at
+        self.size = _ENTRY_OVERHEAD
+        self.loaded_at = loaded_at  # last read from the backend
 
 
 class ConversationStore:
-    """Per-user conversation memory with auto-expiry."""
+    """Per-user conversation memory with auto-expiry and bounded size.
+
+    Users are kept in LRU order and the least recently active ones are
+    evicted once there are more than `max_users` of them or their history
+    takes more than `max_bytes`. Expiry times are kept in a min-heap, so
+    sweep() (run periodically by the sweeper task) removes expired users
+    in O(log n) each, whether or not they ever come back.
+
+    With a `backend` history lives in shared storage, so it survives
+    restarts and is visible to other bot processes. Writes only ever
+    append an exchange or delete a user, never rewrite a history, so
+    processes writing the same user cannot drop each other's turns. They
+    are written behind: add_exchange() and clear() queue them and the
+    flusher sends the queue every `flush_interval` seconds as one batch,
+    keeping failed batches for the next flush. fetch_exchanges() reuses
+    a history read from the backend for `cache_ttl` seconds (the
+    request scheduler runs each user's questions one at a time, so within
+    one process that copy is current), and serves the local copy while
+    the user has queued writes. The backend expires entries after `ttl`
+    on its own.
+    """
 
-    def __init__(self, ttl: int = DEFAULT_TTL, max_exchanges: int = DEFAULT_MAX_EXCHANGES):
-        self._conversations: dict[int, dict] = {}
+    def __init__(
+        self,
+        ttl: int = DEFAULT_TTL,
+        max_exchanges: int = DEFAULT_MAX_EXCHANGES,
+        max_users: int = DEFAULT_MAX_USERS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        backend: ConversationBackend | None = None,
+        flush_interval: float = FLUSH_INTERVAL,
+        cache_ttl: float = CACHE_TTL,
+    ):
+        self._conversations: OrderedDict[int, _Conversation] = OrderedDict()
+        # (expires_at, user_id); entries whose time no longer matches the
+        # user's current expires_at are stale and skipped
+        self._expiry_heap: list[tuple[float, int]] = []
         self._ttl = ttl
         self._max_exchanges = max_exchanges
+        self._max_users = max_users
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._backend = backend
+        self._flush_interval = flush_interval
+        self._cache_ttl = cache_ttl
+        # Writes not yet sent, in order: (user_id, exchange to append), or
+        # (user_id, None) to delete the user
+        self._pending: list[tuple[int, Exchange | None]] = []
+        # user_id -> number of its writes in _pending
+        self._pending_users: dict[int, int] = {}
+        self._tasks: list[asyncio.Task] = []
+        self.evictions = 0
+        self.expirations = 0
+        self.backend_reads = 0
+        self.flushes = 0
+        self.flush_failures = 0
 
-    def get_exchanges(self, user_id: int) -> list[dict]:
-        """Get exchange history for a user. Returns [] if expired or not found."""
+    def get_exchanges(self, user_id: int) -> tuple[Exchange, ...]:
+        """Get exchange history for a user. Returns () if expired or not found.
+
+        The returned tuple is the stored history itself, not a copy.
+        """
         entry = self._conversations.get(user_id)
         if entry is None:
-            return []
+            return ()
 
-        if time.time() - entry["last_active"] > self._ttl:
+        if time.monotonic() > entry.expires_at:
             logger.info("Conversation expired for user %s", user_id)
-            del self._conversations[user_id]
-            return []
+            self._remove(user_id)
+            self.expirations += 1
+            return ()
+
+        self._conversations.move_to_end(user_id)
+        return entry.exchanges
+
+    async def fetch_exchanges(self, user_id: int) -> tuple[Exchange, ...]:
+        """get_exchanges(), reading through to the backend if the local copy is stale."""
+        entry = self._conversations.get(user_id)
+        if (
+            self._backend is None
+            or user_id in self._pending_users
+            or (entry is not None and time.monotonic() - entry.loaded_at <= self._cache_ttl)
+        ):
+            return self.get_exchanges(user_id)
+
+        try:
+            loaded = await self._backend.load(user_id)
+        except Exception as e:
+            logger.warning("Conversation backend read failed for user %s: %r", user_id, e)
+            return self.get_exchanges(user_id)
+        self.backend_reads += 1
+        if user_id in self._pending_users:
+            # Changed locally while the read was in flight
+            return self.get_exchanges(user_id)
 
-        return list(entry["exchanges"])
+        self._remove(user_id)
+        now = time.monotonic()
+        if loaded is None:
+            # Remember "no history" too, so the next message skips the read
+            entry = _Conversation(now + self._cache_ttl, loaded_at=now)
+        else:
+            history, remaining = loaded
+            entry = _Conversation(now + remaining, loaded_at=now)
+            entry.exchanges = tuple(Exchange(*ex) for ex in history)[-self._max_exchanges:]
+            entry.size += sum(_exchange_size(ex) for ex in entry.exchanges)
+        self._conversations[user_id] = entry
+        self._bytes += entry.size
+        self._push_expiry(entry.expires_at, user_id)
+        self._evict()
+        return entry.exchanges
 
     def add_exchange(self, user_id: int, question: str, sql: str, answer: str) -> None:
         """Add a completed exchange to the user's history."""
-        if user_id not in self._conversations:
-            self._conversations[user_id] = {"exchanges": [], "last_active": time.time()}
+        now = time.monotonic()
+        entry = self._conversations.get(user_id)
+        if entry is None or now > entry.expires_at:
+            if entry is not None:
+                self._remove(user_id)
+            entry = _Conversation(now + self._ttl)
+            self._conversations[user_id] = entry
+            self._bytes += entry.size
+        else:
+            self._conversations.move_to_end(user_id)
 
-        entry = self._conversations[user_id]
-        entry["exchanges"].append({"question": question, "sql": sql, "answer": answer})
-        entry["last_active"] = time.time()
+        exchange = Exchange(question, sql, answer)
+        exchanges = entry.exchanges + (exchange,)
+        added = _exchange_size(exchange)
+        dropped = sum(_exchange_size(ex) for ex in exchanges[:-self._max_exchanges])
+        entry.exchanges = exchanges[-self._max_exchanges:]
+        entry.size += added - dropped
+        self._bytes += added - dropped
 
-        if len(entry["exchanges"]) > self._max_exchanges:
-            entry["exchanges"] = entry["exchanges"][-self._max_exchanges:]
+        entry.expires_at = now + self._ttl
+        self._push_expiry(entry.expires_at, user_id)
+        self._queue(user_id, exchange)
+        self._evict()
 
     def clear(self, user_id: int) -> None:
         """Clear conversation history for a user."""
-        self._conversations.pop(user_id, None)
+        self._remove(user_id)
+        self._queue(user_id, None)
+
+    def _queue(self, user_id: int, exchange: Exchange | None) -> None:
+        if self._backend is not None:
+            self._pending.append((user_id, exchange))
+            self._pending_users[user_id] = self._pending_users.get(user_id, 0) + 1
+
+    async def flush(self) -> None:
+        """Send queued writes to the backend in one batch."""
+        if self._backend is None or not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await self._backend.write_many(
+                [(uid, None if ex is None else tuple(ex)) for uid, ex in batch],
+                self._max_exchanges,
+                self._ttl,
+            )
+            self.flushes += 1
+        except Exception as e:
+            self.flush_failures += 1
+            logger.warning("Conversation backend write of %d change(s) failed: %r", len(batch), e)
+            # Retried next time, ahead of anything queued meanwhile
+            self._pending = batch + self._pending
+            return
+        for user_id, _ in batch:
+            count = self._pending_users[user_id] - 1
+            if count:
+                self._pending_users[user_id] = count
+            else:
+                del self._pending_users[user_id]
+
+    def sweep(self) -> int:
+        """Remove all expired users; returns how many were removed."""
+        now = time.monotonic()
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            expires_at, user_id = heapq.heappop(self._expiry_heap)
+            entry = self._conversations.get(user_id)
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(user_id)
+                removed += 1
+        self.expirations += removed
+        if removed:
+            logger.info("Conversation sweep: %d expired user(s) removed", removed)
+        return removed
+
+    def start(self, sweep_interval: float = SWEEP_INTERVAL) -> None:
+        """Start the background sweeper (and the backend flusher, if any)."""
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(
+            self._every(sweep_interval, self.sweep), name="conversation-sweeper",
+        ))
+        if self._backend is not None:
+            self._tasks.append(asyncio.create_task(
+                self._every(self._flush_interval, self.flush), name="conversation-flusher",
+            ))
+
+    async def stop(self) -> None:
+        """Stop background tasks, write out queued changes and close the backend."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._backend is not None:
+            await self.flush()
+            await self._backend.close()
+
+    async def _every(self, interval: float, job) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = job()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.warning("Conversation store %s failed: %r", job.__name__, e)
+
+    def _push_expiry(self, expires_at: float, user_id: int) -> None:
+        heapq.heappush(self._expiry_heap, (expires_at, user_id))
+        # Every add leaves the user's previous heap entry behind; compact
+        # when stale entries start to dominate
+        if len(self._expiry_heap) > 2 * len(self._conversations) + 64:
+            self._expiry_heap = [(e.expires_at, uid) for uid, e in self._conversations.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _remove(self, user_id: int) -> None:
+        entry = self._conversations.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._conversations and (
+            len(self._conversations) > self._max_users or self._bytes > self._max_bytes
+        ):
+            user_id = next(iter(self._conversations))
+            self._remove(user_id)
+            self.evictions += 1
+            logger.info("Conversation evicted for user %s (store full)", user_id)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._conversations),
+            "exchanges": sum(len(e.exchanges) for e in self._conversations.values()),
+            "bytes": self._bytes,
+            "heap_size": len(self._expiry_heap),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "pending_writes": len(self._pending),
+            "backend_reads": self.backend_reads,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+        }
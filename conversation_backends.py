@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# "memory" (process-local only), "sqlite" or "redis"
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")
+CONVERSATION_SQLITE_PATH = os.getenv("CONVERSATION_SQLITE_PATH", ".cache/conversations.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("CONVERSATION_REDIS_PREFIX", "conversation:")
+
+# Stored history: list of (question, sql, answer) triples
+Exchange = tuple[str, str, str]
+History = list[Exchange]
+# One write: append an exchange to the user's history, or delete it (None)
+Write = tuple[int, Exchange | None]
+
+
+class ConversationBackend(ABC):
+    """Shared storage behind ConversationStore.
+
+    Histories are only ever appended to or deleted, never rewritten, so
+    bot processes writing the same user cannot overwrite each other's
+    exchanges. write_many() applies a batch of writes in order: an append
+    adds one exchange, keeps the newest `max_exchanges` and expires the
+    user `ttl` seconds later. load() returns the history and its
+    remaining lifetime in seconds, or None if the user has no live entry.
+    """
+
+    @abstractmethod
+    async def load(self, user_id: int) -> tuple[History, float] | None:
+        ...
+
+    @abstractmethod
+    async def write_many(self, writes: list[Write], max_exchanges: int, ttl: float) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteBackend(ConversationBackend):
+    """Conversations in a local SQLite file, shared by processes on one host.
+
+    One row per exchange; each batch of writes is one transaction.
+    """
+
+    def __init__(self, path: str = CONVERSATION_SQLITE_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            # WAL lets other processes read while one writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversation_exchanges (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    question TEXT NOT NULL,
+                    sql TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS conversation_exchanges_user"
+                " ON conversation_exchanges (user_id, id)"
+            )
+
+    def _load(self, user_id: int) -> tuple[History, float] | None:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT question, sql, answer, expires_at FROM conversation_exchanges"
+                " WHERE user_id = ? AND expires_at > ? ORDER BY id",
+                (user_id, time.time()),
+            ).fetchall()
+        if not rows:
+            return None
+        return [row[:3] for row in rows], max(row[3] for row in rows) - time.time()
+
+    def _write_many(self, writes: list[Write], max_exchanges: int, ttl: float) -> None:
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so batches from
+        # several processes are serialized rather than interleaved
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM conversation_exchanges WHERE expires_at <= ?", (now,))
+                for user_id, exchange in writes:
+                    if exchange is None:
+                        self._conn.execute("DELETE FROM conversation_exchanges WHERE user_id = ?", (user_id,))
+                        continue
+                    self._conn.execute(
+                        "INSERT INTO conversation_exchanges (user_id, question, sql, answer, expires_at)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (user_id, *exchange, now + ttl),
+                    )
+                appended = list({user_id for user_id, exchange in writes if exchange is not None})
+                self._conn.executemany(
+                    """
+                    DELETE FROM conversation_exchanges WHERE user_id = ? AND id NOT IN (
+                        SELECT id FROM conversation_exchanges WHERE user_id = ?
+                        ORDER BY id DESC LIMIT ?
+                    )
+                    """,
+                    [(user_id, user_id, max_exchanges) for user_id in appended],
+                )
+                self._conn.executemany(
+                    "UPDATE conversation_exchanges SET expires_at = ? WHERE user_id = ?",
+                    [(now + ttl, user_id) for user_id in appended],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def load(self, user_id: int) -> tuple[History, float] | None:
+        return await asyncio.to_thread(self._load, user_id)
+
+    async def write_many(self, writes: list[Write], max_exchanges: int, ttl: float) -> None:
+        await asyncio.to_thread(self._write_many, writes, max_exchanges, ttl)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisBackend(ConversationBackend):
+    """Conversations in Redis (or any server speaking its protocol).
+
+    Each user is one list of JSON exchanges with a server-side expiry. A
+    batch of writes is one MULTI transaction: RPUSH + LTRIM + PEXPIRE per
+    append, DEL per delete.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_KEY_PREFIX, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("CONVERSATION_BACKEND=redis requires the redis package") from None
+            client = redis.from_url(url)
+        self._redis = client
+        self._prefix = prefix
+
+    def _key(self, user_id: int) -> str:
+        return f"{self._prefix}{user_id}:exchanges"
+
+    async def load(self, user_id: int) -> tuple[History, float] | None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(self._key(user_id), 0, -1)
+            pipe.pttl(self._key(user_id))
+            values, pttl = await pipe.execute()
+        if not values:
+            return None
+        return [tuple(json.loads(v)) for v in values], max(pttl, 0) / 1000
+
+    async def write_many(self, writes: list[Write], max_exchanges: int, ttl: float) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for user_id, exchange in writes:
+                key = self._key(user_id)
+                if exchange is None:
+                    pipe.delete(key)
+                    continue
+                pipe.rpush(key, json.dumps(list(exchange), ensure_ascii=False))
+                pipe.ltrim(key, -max_exchanges, -1)
+                pipe.pexpire(key, int(ttl * 1000))
+            await pipe.execute()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_backend(kind: str = CONVERSATION_BACKEND) -> ConversationBackend | None:
+    """Backend selected by CONVERSATION_BACKEND; None keeps history in memory only."""
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown CONVERSATION_BACKEND: {kind!r}")
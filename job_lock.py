@@ -0,0 +1,91 @@
+import os
+import fcntl
+import socket
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# "file" (replicas on one host) or "redis" (replicas anywhere, uses REDIS_URL)
+JOB_LOCK_BACKEND = os.getenv("JOB_LOCK_BACKEND", "file")
+JOB_LOCK_DIR = os.getenv("JOB_LOCK_DIR", ".cache/locks")
+JOB_LOCK_TTL = int(os.getenv("JOB_LOCK_TTL", "86400"))
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim_file(name: str, run_key: str) -> bool:
+    os.makedirs(JOB_LOCK_DIR, exist_ok=True)
+    with open(os.path.join(JOB_LOCK_DIR, f"{name}.lock"), "a+", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            if f.read().strip() == run_key:
+                return False
+            f.seek(0)
+            f.truncate()
+            f.write(run_key)
+            f.flush()
+            return True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _release_file(name: str, run_key: str) -> None:
+    path = os.path.join(JOB_LOCK_DIR, f"{name}.lock")
+    if not os.path.exists(path):
+        return
+    with open(path, "r+", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if f.read().strip() == run_key:
+                f.seek(0)
+                f.truncate()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+async def _claim_redis(name: str, run_key: str) -> bool:
+    import redis.asyncio as redis
+    from conversation_backends import REDIS_URL
+
+    client = redis.from_url(REDIS_URL)
+    try:
+        return bool(await client.set(f"job-lock:{name}:{run_key}", _OWNER, nx=True, ex=JOB_LOCK_TTL))
+    finally:
+        await client.aclose()
+
+
+async def claim_job_run(name: str, run_key: str) -> bool:
+    """True if this process should run job `name` for `run_key` (e.g. the date).
+
+    The first replica to claim a run wins; the others get False for the
+    same key. With the file backend this holds only for replicas sharing
+    JOB_LOCK_DIR; use JOB_LOCK_BACKEND=redis across hosts.
+    """
+    if JOB_LOCK_BACKEND == "redis":
+        claimed = await _claim_redis(name, run_key)
+    else:
+        claimed = await asyncio.to_thread(_claim_file, name, run_key)
+    if not claimed:
+        logger.info("Job %s for %s already claimed by another replica", name, run_key)
+    return claimed
+
+
+async def release_job_run(name: str, run_key: str) -> None:
+    """Give up a claim after the run failed, so a later attempt (on any
+    replica) can claim `run_key` again."""
+    try:
+        if JOB_LOCK_BACKEND == "redis":
+            import redis.asyncio as redis
+            from conversation_backends import REDIS_URL
+
+            client = redis.from_url(REDIS_URL)
+            try:
+                await client.delete(f"job-lock:{name}:{run_key}")
+            finally:
+                await client.aclose()
+        else:
+            await asyncio.to_thread(_release_file, name, run_key)
+    except Exception as e:
+        logger.warning("Could not release job %s for %s: %r", name, run_key, e)
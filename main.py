@@ -1,14 +1,20 @@
 import os
 import asyncio
 import logging
+from datetime import datetime
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 import pytz
 
-from bot.telegram import create_bot, create_dispatcher, send_report
-from queries.activity import get_all_activity_metrics
-from ai.insights import generate_activity_report
+from bot.queue import SHUTDOWN_DRAIN_TIMEOUT
+from bot.telegram import (
+    conversation_store, create_bot, create_dispatcher, request_scheduler, send_report,
+)
+from job_lock import claim_job_run, release_job_run
+from queries.base import warm_up
+from reports import report_store
+from supabase_client import qa_log_writer
 
 load_dotenv()
 
@@ -19,17 +25,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# "polling" (default) or "webhook" (see bot/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Polling refuses to start while a webhook is set, since deleting it
+# would cut off every webhook replica; set to 1 to delete it anyway
+BOT_DELETE_WEBHOOK = os.getenv("BOT_DELETE_WEBHOOK", "0") == "1"
+
 
-async def scheduled_report(bot) -> None:
+async def scheduled_report(bot, tz) -> None:
     """Generate and send the daily activity report."""
+    # Every replica schedules the job; only the first to claim today's run
+    # (in the schedule's timezone) sends it
+    run_key = datetime.now(tz).date().isoformat()
+    if not await claim_job_run("daily_report", run_key):
+        return
     logger.info("Starting scheduled report generation")
     try:
-        metrics = get_all_activity_metrics()
-        report = generate_activity_report(metrics)
+        # Always regenerate; the result is stored and served to /report
+        report = await report_store.get(force=True)
         await send_report(bot, report)
         logger.info("Activity report sent successfully")
     except Exception as e:
         logger.exception(f"Failed to generate/send report: {e}")
+        await release_job_run("daily_report", run_key)
 
 
 async def main() -> None:
@@ -39,28 +57,57 @@ async def main() -> None:
     timezone = os.getenv("TIMEZONE", "Europe/Moscow")
     hour, minute = map(int, report_time.split(":"))
 
-    logger.info("Starting AI Analyst Bot")
+    logger.info("Starting AI Analyst Bot (%s mode)", BOT_MODE)
     logger.info(f"Daily report scheduled at {report_time} ({timezone})")
 
+    # Open ClickHouse connections before the first user query arrives
+    warm_up()
+    # Q&A logs are written to Supabase in the background
+    qa_log_writer.start()
+    # Drop expired conversations even for users who never come back, and
+    # with a shared backend, send queued history writes to it in batches
+    conversation_store.start()
+
     # Create bot and dispatcher
     bot = create_bot()
     dp = create_dispatcher()
 
     # Set up scheduler
-    scheduler = AsyncIOScheduler(timezone=pytz.timezone(timezone))
+    tz = pytz.timezone(timezone)
+    scheduler = AsyncIOScheduler(timezone=tz)
     scheduler.add_job(
         scheduled_report,
         CronTrigger(hour=hour, minute=minute),
-        args=[bot],
+        args=[bot, tz],
         id="daily_report",
         name="Daily Activity Report",
     )
     scheduler.start()
 
-    # Start polling
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            from bot.webhook import run_webhook
+            await run_webhook(bot, dp)
+        else:
+            webhook = await bot.get_webhook_info()
+            if webhook.url:
+                if not BOT_DELETE_WEBHOOK:
+                    logger.error(
+                        "A webhook is set (%s), so polling would get no updates. "
+                        "Stop the webhook replicas and set BOT_DELETE_WEBHOOK=1 to poll.",
+                        webhook.url,
+                    )
+                    return
+                logger.warning("Deleting webhook %s to start polling", webhook.url)
+                await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
+        scheduler.shutdown(wait=False)
+        # Let accepted questions finish before their history and logs are flushed
+        if not await request_scheduler.drain(SHUTDOWN_DRAIN_TIMEOUT):
+            logger.warning("Q&A requests still running after %ss; abandoning them", SHUTDOWN_DRAIN_TIMEOUT)
+        await conversation_store.stop()
+        await qa_log_writer.stop()
         await bot.session.close()
 
 
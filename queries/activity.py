@@ -1,15 +1,52 @@
+import os
+import copy
+import time
+import asyncio
+import logging
 from datetime import date, timedelta
-from queries.base import execute_query
+from typing import NamedTuple
+from queries.base import execute_query_async, execute_query_columnar_async
+from queries.cache import MetricsCache
 
+logger = logging.getLogger(__name__)
 
-def get_last_available_date() -> date:
+# "consolidated" (one scan), "parallel" (one query per section, run concurrently)
+# or "rollup" (local per-day aggregates, see queries.rollup)
+METRICS_MODE = os.getenv("ACTIVITY_METRICS_MODE", "consolidated")
+PARALLEL_CONCURRENCY = int(os.getenv("ACTIVITY_PARALLEL_CONCURRENCY", "4"))
+SECTION_TIMEOUT = float(os.getenv("ACTIVITY_SECTION_TIMEOUT", "30"))
+WATERMARK_CHECK_INTERVAL = float(os.getenv("WATERMARK_CHECK_INTERVAL", "300"))
+
+metrics_cache = MetricsCache(
+    max_entries=int(os.getenv("METRICS_CACHE_SIZE", "32")),
+    ttl=float(os.getenv("METRICS_CACHE_TTL", "900")),
+    closed_ttl=float(os.getenv("METRICS_CACHE_CLOSED_TTL", "86400")),
+)
+_watermark: tuple[date, float] | None = None
+
+
+class _Bucket(NamedTuple):
+    """One aggregated row of the consolidated query, minus its kind."""
+    key: str
+    extra: str
+    submissions: int
+    students: int
+    schools: int
+    regions: int
+    avg_score: float
+
+
+_EMPTY_BUCKET = _Bucket("", "", 0, 0, 0, 0, 0.0)
+
+
+async def get_last_available_date() -> date:
     """Get the most recent submission date in work_results_n."""
     query = """
     SELECT max(toDate(submission_date)) as last_date
     FROM work_results_n
     WHERE submission_date IS NOT NULL AND submission_date != ''
     """
-    results = execute_query(query)
+    results = await execute_query_async(query)
     if results and results[0]["last_date"]:
         last_date = results[0]["last_date"]
         if isinstance(last_date, date):
@@ -18,7 +55,15 @@ def get_last_available_date() -> date:
     return date.today() - timedelta(days=1)
 
 
-def get_daily_activity(target_date: date) -> dict:
+async def get_data_watermark(max_age: float = WATERMARK_CHECK_INTERVAL) -> date:
+    """get_last_available_date(), re-queried at most once per `max_age` seconds."""
+    global _watermark
+    if _watermark is None or time.monotonic() - _watermark[1] > max_age:
+        _watermark = (await get_last_available_date(), time.monotonic())
+    return _watermark[0]
+
+
+async def get_daily_activity(target_date: date) -> dict:
     """Core activity counts for a specific date."""
     query = f"""
     SELECT
@@ -29,7 +74,7 @@ def get_daily_activity(target_date: date) -> dict:
     FROM work_results_n
     WHERE toDate(submission_date) = '{target_date}'
     """
-    results = execute_query(query)
+    results = await execute_query_async(query)
     if results:
         return results[0]
     return {
@@ -38,7 +83,7 @@ def get_daily_activity(target_date: date) -> dict:
     }
 
 
-def get_weekly_submission_trend(target_date: date) -> list[dict]:
+async def get_weekly_submission_trend(target_date: date) -> list[dict]:
     """Daily submission counts for the current week (from Monday)."""
     start = target_date - timedelta(days=target_date.weekday())
     query = f"""
@@ -52,10 +97,10 @@ def get_weekly_submission_trend(target_date: date) -> list[dict]:
     GROUP BY day
     ORDER BY day
     """
-    return execute_query(query)
+    return await execute_query_async(query)
 
 
-def get_submissions_by_parallel(target_date: date) -> list[dict]:
+async def get_submissions_by_parallel(target_date: date) -> list[dict]:
     """Submission counts by grade level (parallel) for a specific date."""
     query = f"""
     SELECT
@@ -68,10 +113,10 @@ def get_submissions_by_parallel(target_date: date) -> list[dict]:
     GROUP BY parallel
     ORDER BY parallel
     """
-    return execute_query(query)
+    return await execute_query_async(query)
 
 
-def get_submissions_by_work_type(target_date: date) -> list[dict]:
+async def get_submissions_by_work_type(target_date: date) -> list[dict]:
     """Submission counts by work type for a specific date."""
     query = f"""
     SELECT
@@ -84,10 +129,10 @@ def get_submissions_by_work_type(target_date: date) -> list[dict]:
     GROUP BY work_type
     ORDER BY submissions DESC
     """
-    return execute_query(query)
+    return await execute_query_async(query)
 
 
-def get_top_active_regions(target_date: date, limit: int = 10) -> list[dict]:
+async def get_top_active_regions(target_date: date, limit: int = 10) -> list[dict]:
     """Top regions by submission count for a specific date."""
     query = f"""
     SELECT
@@ -102,10 +147,10 @@ def get_top_active_regions(target_date: date, limit: int = 10) -> list[dict]:
     ORDER BY submissions DESC
     LIMIT {limit}
     """
-    return execute_query(query)
+    return await execute_query_async(query)
 
 
-def get_top_active_schools(target_date: date, limit: int = 10) -> list[dict]:
+async def get_top_active_schools(target_date: date, limit: int = 10) -> list[dict]:
     """Top schools by submission count for a specific date."""
     query = f"""
     SELECT
@@ -120,10 +165,10 @@ def get_top_active_schools(target_date: date, limit: int = 10) -> list[dict]:
     ORDER BY submissions DESC
     LIMIT {limit}
     """
-    return execute_query(query)
+    return await execute_query_async(query)
 
 
-def get_status_breakdown(target_date: date) -> list[dict]:
+async def get_status_breakdown(target_date: date) -> list[dict]:
     """Submission status breakdown for a specific date."""
     query = f"""
     SELECT
@@ -135,10 +180,10 @@ def get_status_breakdown(target_date: date) -> list[dict]:
     GROUP BY status
     ORDER BY cnt DESC
     """
-    return execute_query(query)
+    return await execute_query_async(query)
 
 
-def get_weekly_comparison(target_date: date) -> dict:
+async def get_weekly_comparison(target_date: date) -> dict:
     """Compare this week vs equivalent days of last week.
 
     If target_date is Wednesday, compares Mon-Wed this week
@@ -169,7 +214,7 @@ def get_weekly_comparison(target_date: date) -> dict:
     WHERE toDate(submission_date) >= '{last_week_start}'
       AND toDate(submission_date) <= '{last_week_end}'
     """
-    results = execute_query(query)
+    results = await execute_query_async(query)
     data = {}
     for row in results:
         period = row["period"]
@@ -183,25 +228,238 @@ def get_weekly_comparison(target_date: date) -> dict:
     return data
 
 
-def get_all_activity_metrics(target_date: date = None) -> dict:
-    """Collect all activity/engagement metrics.
+async def get_consolidated_activity_metrics(target_date: date, limit: int = 10) -> dict:
+    """All report metrics for target_date from a single scan of work_results_n.
 
-    Defaults to yesterday since today's data is incomplete.
+    Every row in the report window (Monday of last week .. target_date) is
+    fanned out with ARRAY JOIN into one tagged tuple per breakdown it belongs
+    to, so the per-day totals, both weekly periods and the target-day
+    breakdowns are all aggregated by one GROUP BY. Returns the same shape as
+    the individual get_* functions.
     """
-    if target_date is None:
-        target_date = date.today() - timedelta(days=1)
+    previous_date = target_date - timedelta(days=1)
+    this_week_start = target_date - timedelta(days=target_date.weekday())
+    last_week_start = this_week_start - timedelta(days=7)
+    last_week_end = target_date - timedelta(days=7)
+
+    query = f"""
+    SELECT
+        tag.1 AS kind,
+        tag.2 AS key,
+        tag.3 AS extra,
+        count() as submissions,
+        count(DISTINCT student_id) as students,
+        count(DISTINCT school) as schools,
+        count(DISTINCT region) as regions,
+        round(avg(result_percent), 1) as avg_score
+    FROM (
+        SELECT
+            toDate(submission_date) as day,
+            student_id, school, region, parallel, work_type, status, result_percent
+        FROM work_results_n
+        WHERE day >= '{last_week_start}'
+          AND day <= '{target_date}'
+    )
+    ARRAY JOIN arrayConcat(
+        [('day', toString(day), '')],
+        if(day >= '{this_week_start}', [('week', 'this_week', '')], []),
+        if(day >= '{last_week_start}' AND day <= '{last_week_end}', [('week', 'last_week', '')], []),
+        if(day = '{target_date}', [
+            ('parallel', parallel, ''),
+            ('work_type', work_type, ''),
+            ('region', region, ''),
+            ('school', school, region),
+            ('status', status, '')
+        ], [])
+    ) AS tag
+    WHERE kind IN ('day', 'week') OR key != ''
+    GROUP BY kind, key, extra
+    """
+    result = await execute_query_columnar_async(query)
+
+    groups: dict[str, list[_Bucket]] = {}
+    for kind, *values in result.rows():
+        groups.setdefault(kind, []).append(_Bucket(*values))
+
+    def by_submissions(buckets: list[_Bucket]) -> list[_Bucket]:
+        return sorted(buckets, key=lambda b: b.submissions, reverse=True)
+
+    days = {b.key: b for b in groups.get("day", [])}
+
+    def daily(day: date) -> dict:
+        b = days.get(str(day), _EMPTY_BUCKET)
+        return {
+            "total_submissions": b.submissions,
+            "active_students": b.students,
+            "active_schools": b.schools,
+            "active_regions": b.regions,
+        }
+
+    weeks = {b.key: b for b in groups.get("week", [])}
+    weekly_comparison = {}
+    for period, start, end in (
+        ("this_week", this_week_start, target_date),
+        ("last_week", last_week_start, last_week_end),
+    ):
+        b = weeks.get(period, _EMPTY_BUCKET)
+        weekly_comparison[period] = {
+            "submissions": b.submissions,
+            "active_schools": b.schools,
+            "active_students": b.students,
+            "start_date": str(start),
+            "end_date": str(end),
+        }
+
+    return {
+        "activity_today": daily(target_date),
+        "activity_yesterday": daily(previous_date),
+        "weekly_trend": [
+            {"day": date.fromisoformat(key), "submissions": b.submissions, "students": b.students}
+            for key, b in sorted(days.items())
+            if key >= str(this_week_start)
+        ],
+        "weekly_comparison": weekly_comparison,
+        "by_parallel": [
+            {"parallel": b.key, "submissions": b.submissions, "students": b.students}
+            for b in sorted(groups.get("parallel", []), key=lambda b: b.key)
+        ],
+        "by_work_type": [
+            {"work_type": b.key, "submissions": b.submissions, "avg_score": b.avg_score}
+            for b in by_submissions(groups.get("work_type", []))
+        ],
+        "top_schools": [
+            {"school": b.key, "region": b.extra, "submissions": b.submissions, "students": b.students}
+            for b in by_submissions(groups.get("school", []))[:limit]
+        ],
+        "top_regions": [
+            {"region": b.key, "submissions": b.submissions, "schools": b.schools, "students": b.students}
+            for b in by_submissions(groups.get("region", []))[:limit]
+        ],
+        "status_breakdown": [
+            {"status": b.key, "cnt": b.submissions}
+            for b in by_submissions(groups.get("status", []))
+        ],
+    }
+
 
+async def get_parallel_activity_metrics(
+    target_date: date,
+    concurrency: int = PARALLEL_CONCURRENCY,
+    timeout: float = SECTION_TIMEOUT,
+) -> dict:
+    """All report metrics for target_date, one query per section run concurrently.
+
+    At most `concurrency` sections are queried at once and each gets its own
+    `timeout`. A section that fails or times out is left empty and listed
+    under "missing" so the report can still be built from the rest.
+    Per-section wall times are returned under "timings_ms".
+    """
     previous_date = target_date - timedelta(days=1)
+    sections = {
+        "activity_today": (lambda: get_daily_activity(target_date), {}),
+        "activity_yesterday": (lambda: get_daily_activity(previous_date), {}),
+        "weekly_trend": (lambda: get_weekly_submission_trend(target_date), []),
+        "weekly_comparison": (lambda: get_weekly_comparison(target_date), {}),
+        "by_parallel": (lambda: get_submissions_by_parallel(target_date), []),
+        "by_work_type": (lambda: get_submissions_by_work_type(target_date), []),
+        "top_schools": (lambda: get_top_active_schools(target_date), []),
+        "top_regions": (lambda: get_top_active_regions(target_date), []),
+        "status_breakdown": (lambda: get_status_breakdown(target_date), []),
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+    timings_ms: dict[str, int] = {}
+    missing: list[str] = []
+
+    async def run(name: str, fetch, empty):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                return await asyncio.wait_for(fetch(), timeout)
+            except Exception as e:
+                logger.warning("Report section %s failed: %r", name, e)
+                missing.append(name)
+                return empty
+            finally:
+                timings_ms[name] = int((time.monotonic() - start) * 1000)
+
+    values = await asyncio.gather(
+        *(run(name, fetch, empty) for name, (fetch, empty) in sections.items())
+    )
+    metrics = dict(zip(sections, values))
+    metrics["missing"] = [name for name in sections if name in missing]
+    metrics["timings_ms"] = timings_ms
+    logger.info("Parallel activity metrics for %s: %s", target_date, timings_ms)
+    return metrics
+
+
+async def _collect_activity_metrics(target_date: date) -> dict:
+    """Query all metrics using the configured ACTIVITY_METRICS_MODE."""
+    if METRICS_MODE == "parallel":
+        return {"date": str(target_date), **await get_parallel_activity_metrics(target_date)}
+
+    start = time.monotonic()
+    if METRICS_MODE == "rollup":
+        # Imported here: queries.rollup itself depends on this module
+        from queries.rollup import get_rollup_store
+        try:
+            metrics = await get_rollup_store().get_activity_metrics(target_date)
+            return {
+                "date": str(target_date),
+                **metrics,
+                "missing": [],
+                "timings_ms": {"rollup": int((time.monotonic() - start) * 1000)},
+            }
+        except Exception as e:
+            logger.warning("Rollup activity metrics failed, falling back to consolidated: %r", e)
+            start = time.monotonic()
+
+    try:
+        metrics = await get_consolidated_activity_metrics(target_date)
+    except Exception as e:
+        logger.warning("Consolidated activity metrics failed, falling back to parallel: %r", e)
+        return {"date": str(target_date), **await get_parallel_activity_metrics(target_date)}
 
     return {
         "date": str(target_date),
-        "activity_today": get_daily_activity(target_date),
-        "activity_yesterday": get_daily_activity(previous_date),
-        "weekly_trend": get_weekly_submission_trend(target_date),
-        "weekly_comparison": get_weekly_comparison(target_date),
-        "by_parallel": get_submissions_by_parallel(target_date),
-        "by_work_type": get_submissions_by_work_type(target_date),
-        "top_schools": get_top_active_schools(target_date),
-        "top_regions": get_top_active_regions(target_date),
-        "status_breakdown": get_status_breakdown(target_date),
+        **metrics,
+        "missing": [],
+        "timings_ms": {"consolidated": int((time.monotonic() - start) * 1000)},
     }
+
+
+async def get_all_activity_metrics(target_date: date = None, use_cache: bool = True) -> dict:
+    """Collect all activity/engagement metrics.
+
+    Defaults to yesterday since today's data is incomplete. Uses the
+    single-scan query unless ACTIVITY_METRICS_MODE is parallel or rollup;
+    rollup falls back to the single scan, and if the single scan fails,
+    it falls back to the per-section parallel queries.
+
+    Results are served from `metrics_cache` while still valid; pass
+    use_cache=False to force a fresh computation. Partial results (with
+    missing sections) are never cached.
+    """
+    if target_date is None:
+        target_date = date.today() - timedelta(days=1)
+
+    key = (target_date, METRICS_MODE)
+    if use_cache:
+        cached = None
+        try:
+            watermark = await get_data_watermark() if metrics_cache.needs_watermark(key) else None
+            cached = metrics_cache.get(key, watermark)
+        except Exception as e:
+            logger.warning("Could not read data watermark, treating as cache miss: %r", e)
+        if cached is not None:
+            logger.info("Activity metrics for %s served from cache %s", target_date, metrics_cache.stats())
+            return copy.deepcopy(cached)
+
+    metrics = await _collect_activity_metrics(target_date)
+
+    if not metrics["missing"]:
+        try:
+            watermark = await get_data_watermark()
+            metrics_cache.put(key, copy.deepcopy(metrics), watermark, closed=target_date < watermark)
+        except Exception as e:
+            logger.warning("Could not read data watermark, metrics not cached: %r", e)
+    return metrics
@@ -1,35 +1,269 @@
 import os
+import math
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Sequence
 from dotenv import load_dotenv
 import clickhouse_connect
+from clickhouse_connect import common
+from clickhouse_connect.driver import httputil
+from clickhouse_connect.driver.exceptions import OperationalError
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-def get_client():
-    """Create and return a ClickHouse client."""
+POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "16"))
+KEEPALIVE_INTERVAL = int(os.getenv("CLICKHOUSE_KEEPALIVE_INTERVAL", "30"))
+HEALTH_CHECK_INTERVAL = int(os.getenv("CLICKHOUSE_HEALTH_CHECK_INTERVAL", "60"))
+QUERY_TIMEOUT = float(os.getenv("CLICKHOUSE_QUERY_TIMEOUT", "60"))
+MAX_CONCURRENT_QUERIES = int(os.getenv("CLICKHOUSE_MAX_CONCURRENT_QUERIES", "8"))
+# Wire compression for result blocks: lz4, zstd, gzip, br, or "false"
+COMPRESSION = os.getenv("CLICKHOUSE_COMPRESSION", "lz4")
+
+_client = None
+_pool_mgr = None
+_client_lock = threading.Lock()
+_last_used = 0.0
+
+# Blocking driver calls run here so they never stall the event loop
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES, thread_name_prefix="clickhouse")
+_semaphore: asyncio.Semaphore | None = None
+
+# Process-wide totals from the X-ClickHouse-Summary header of each query
+_stats = {"queries": 0, "read_rows": 0, "read_bytes": 0}
+_stats_lock = threading.Lock()
+
+
+class QueryTimeoutError(Exception):
+    """Raised when an async query does not finish within its timeout."""
+
+
+@dataclass
+class ColumnarResult:
+    """Column-oriented query result, as delivered by the Native format.
+
+    Avoids building a dict per row. Columns are plain lists; to_numpy()
+    converts a single column for vectorized work.
+    """
+    column_names: tuple[str, ...]
+    columns: tuple[Sequence, ...]
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, name: str) -> Sequence:
+        return self.columns[self.column_names.index(name)]
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*self.columns)
+
+    def to_dicts(self, limit: int | None = None) -> list[dict]:
+        """Materialize (the first `limit`) rows as dicts."""
+        rows = self.rows()
+        if limit is not None:
+            rows = (row for _, row in zip(range(limit), rows))
+        return [dict(zip(self.column_names, row)) for row in rows]
+
+    def to_numpy(self, name: str):
+        """Column as a NumPy array."""
+        import numpy as np
+        return np.asarray(self.column(name))
+
+
+def _parse_host() -> tuple[str, int]:
+    """Extract host and port from CLICKHOUSE_HOST."""
     host = os.getenv("CLICKHOUSE_HOST", "http://localhost:8123")
-    # Extract host and port from URL
     host_clean = host.replace("http://", "").replace("https://", "")
     if ":" in host_clean:
         host_part, port_part = host_clean.split(":")
-        port = int(port_part)
-    else:
-        host_part = host_clean
-        port = 8123
+        return host_part, int(port_part)
+    return host_clean, 8123
 
-    return clickhouse_connect.get_client(
-        host=host_part,
+
+def _create_client():
+    """Create a ClickHouse client backed by its own keep-alive connection pool."""
+    global _pool_mgr
+    host, port = _parse_host()
+    # Session ids serialize queries on the server; the shared client
+    # is used by many callers at once, so it must not carry one.
+    common.set_setting("autogenerate_session_id", False)
+    _pool_mgr = httputil.get_pool_manager(
+        keep_interval=KEEPALIVE_INTERVAL,
+        maxsize=POOL_SIZE,
+        num_pools=1,
+        block=True,
+    )
+    client = clickhouse_connect.get_client(
+        host=host,
         port=port,
         database=os.getenv("CLICKHOUSE_DATABASE", "default"),
         username=os.getenv("CLICKHOUSE_USER", "default"),
         password=os.getenv("CLICKHOUSE_PASSWORD", ""),
+        pool_mgr=_pool_mgr,
+        compress=COMPRESSION,
     )
+    logger.info("ClickHouse client created for %s:%s (pool size %d)", host, port, POOL_SIZE)
+    return client
+
+
+def get_client():
+    """Return the process-wide ClickHouse client, creating it on first use.
+
+    If the client has been idle longer than CLICKHOUSE_HEALTH_CHECK_INTERVAL,
+    it is pinged first and recreated when the server does not answer.
+    """
+    global _client, _last_used
+    with _client_lock:
+        if _client is not None and time.monotonic() - _last_used > HEALTH_CHECK_INTERVAL:
+            if not _client.ping():
+                logger.warning("ClickHouse health check failed, reconnecting")
+                _close_client_locked()
+        if _client is None:
+            _client = _create_client()
+        _last_used = time.monotonic()
+        return _client
+
+
+def _close_client_locked() -> None:
+    global _client, _pool_mgr
+    if _client is not None:
+        try:
+            _client.close()
+            _pool_mgr.clear()
+        except Exception as e:
+            logger.debug("Error closing ClickHouse client: %s", e)
+        _client = None
+        _pool_mgr = None
+
 
+def reset_client() -> None:
+    """Drop the shared client so the next call reconnects."""
+    with _client_lock:
+        _close_client_locked()
 
-def execute_query(query: str) -> list[dict]:
+
+def warm_up() -> bool:
+    """Open the connection pool ahead of the first query. Never raises."""
+    try:
+        client = get_client()
+        client.query("SELECT 1")
+        logger.info("ClickHouse connection warmed up")
+        return True
+    except Exception as e:
+        logger.warning("ClickHouse warm-up failed: %s", e)
+        return False
+
+
+def _run_query(query: str, settings: dict | None, **options):
+    """Run client.query, retrying once on a fresh connection.
+
+    Connection-level failures drop the pooled client; query errors are
+    raised as is.
+    """
+    try:
+        result = get_client().query(query, settings=settings, **options)
+    except OperationalError as e:
+        logger.warning("ClickHouse connection error, reconnecting: %s", e)
+        reset_client()
+        result = get_client().query(query, settings=settings, **options)
+    _record_stats(result.summary)
+    return result
+
+
+def execute_query(query: str, settings: dict | None = None) -> list[dict]:
     """Execute a query and return results as list of dicts."""
-    client = get_client()
-    result = client.query(query)
+    result = _run_query(query, settings)
     columns = result.column_names
     rows = result.result_rows
     return [dict(zip(columns, row)) for row in rows]
+
+
+def execute_query_columnar(query: str, settings: dict | None = None) -> ColumnarResult:
+    """Execute a query and return its columns without building rows."""
+    result = _run_query(query, settings, column_oriented=True)
+    return ColumnarResult(tuple(result.column_names), tuple(result.result_columns))
+
+
+def _record_stats(summary: dict) -> None:
+    with _stats_lock:
+        _stats["queries"] += 1
+        _stats["read_rows"] += int(summary.get("read_rows") or 0)
+        _stats["read_bytes"] += int(summary.get("read_bytes") or 0)
+
+
+def get_query_stats() -> dict:
+    """Return cumulative query count and rows/bytes read by this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    return _semaphore
+
+
+def _kill_query(query_id: str) -> None:
+    """Ask the server to stop a query we are no longer waiting for."""
+    try:
+        get_client().command(f"KILL QUERY WHERE query_id = '{query_id}' ASYNC")
+    except Exception as e:
+        logger.warning("Failed to kill ClickHouse query %s: %s", query_id, e)
+
+
+async def execute_query_async(
+    query: str,
+    timeout: float | None = None,
+    settings: dict | None = None,
+) -> list[dict]:
+    """Execute a query without blocking the event loop.
+
+    At most CLICKHOUSE_MAX_CONCURRENT_QUERIES queries run at once; the rest
+    wait their turn. The timeout (CLICKHOUSE_QUERY_TIMEOUT by default) is
+    also sent to the server as max_execution_time, and a query that times
+    out or whose caller is cancelled is killed on the server.
+    """
+    return await _run_async(execute_query, query, timeout, settings)
+
+
+async def execute_query_columnar_async(
+    query: str,
+    timeout: float | None = None,
+    settings: dict | None = None,
+) -> ColumnarResult:
+    """Async counterpart of execute_query_columnar, see execute_query_async."""
+    return await _run_async(execute_query_columnar, query, timeout, settings)
+
+
+async def _run_async(
+    execute: Callable[[str, dict], Any],
+    query: str,
+    timeout: float | None,
+    settings: dict | None,
+) -> Any:
+    if timeout is None:
+        timeout = QUERY_TIMEOUT
+    query_id = str(uuid.uuid4())
+    query_settings = {"max_execution_time": math.ceil(timeout), **(settings or {}), "query_id": query_id}
+
+    loop = asyncio.get_running_loop()
+    async with _get_semaphore():
+        future = loop.run_in_executor(_executor, execute, query, query_settings)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("ClickHouse query %s timed out after %ss", query_id, timeout)
+            loop.run_in_executor(None, _kill_query, query_id)
+            raise QueryTimeoutError(f"Query exceeded the {timeout:g}s timeout") from None
+        except asyncio.CancelledError:
+            logger.info("ClickHouse query %s cancelled", query_id)
+            loop.run_in_executor(None, _kill_query, query_id)
+            raise
@@ -0,0 +1,81 @@
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    watermark: date | None
+    closed: bool
+    expires_at: float
+
+
+class MetricsCache:
+    """LRU cache for report metrics with TTL and data-watermark invalidation.
+
+    Entries for days that are already closed (the data watermark has moved
+    past them) are treated as immutable and kept for `closed_ttl`. Entries
+    for days that may still receive data live for `ttl` and are dropped as
+    soon as the watermark they were computed at changes.
+    """
+
+    def __init__(self, max_entries: int = 32, ttl: float = 900, closed_ttl: float = 86400):
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._closed_ttl = closed_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def needs_watermark(self, key: Hashable) -> bool:
+        """True if validating the cached entry for `key` requires the current watermark."""
+        entry = self._entries.get(key)
+        return entry is not None and not entry.closed
+
+    def get(self, key: Hashable, watermark: date | None = None) -> Any | None:
+        """Return the cached value, or None if missing, expired or stale."""
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() > entry.expires_at:
+            del self._entries[key]
+            entry = None
+        if entry is not None and not entry.closed and watermark is not None and watermark != entry.watermark:
+            logger.info("Data watermark moved %s -> %s, invalidating %s", entry.watermark, watermark, key)
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key: Hashable, value: Any, watermark: date | None, closed: bool) -> None:
+        """Store a value computed while the data watermark was `watermark`."""
+        ttl = self._closed_ttl if closed else self._ttl
+        self._entries[key] = CacheEntry(value, watermark, closed, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,73 @@
+import os
+import time
+import logging
+from dataclasses import dataclass
+from queries.base import execute_query_async
+
+logger = logging.getLogger(__name__)
+
+ESTIMATE_TIMEOUT = float(os.getenv("CLICKHOUSE_ESTIMATE_TIMEOUT", "5"))
+# How long per-table sizes are reused
+TABLE_SIZE_TTL = float(os.getenv("CLICKHOUSE_TABLE_SIZE_TTL", "3600"))
+
+# (database, table) -> (bytes per row, total rows, expires_at)
+_table_sizes: dict[tuple[str, str], tuple[float, int, float]] = {}
+
+
+@dataclass
+class CostEstimate:
+    """What a query is expected to read, per EXPLAIN ESTIMATE.
+
+    bytes is derived from the average on-disk row size of each table, as
+    EXPLAIN ESTIMATE itself only reports parts, rows and marks; table_rows
+    is the total size of the tables read, to compare rows against.
+    """
+    rows: int = 0
+    parts: int = 0
+    marks: int = 0
+    bytes: int = 0
+    table_rows: int = 0
+
+
+async def _sizes(tables: set[tuple[str, str]]) -> dict[tuple[str, str], tuple[float, int]]:
+    """(bytes per row, total rows) of each table, from system.tables."""
+    now = time.monotonic()
+    sizes = {t: _table_sizes[t][:2] for t in tables if t in _table_sizes and _table_sizes[t][2] > now}
+    missing = tables - sizes.keys()
+    if missing:
+        conditions = " OR ".join(
+            f"(database = '{db}' AND name = '{name}')" for db, name in sorted(missing)
+        )
+        rows = await execute_query_async(
+            f"SELECT database, name, total_bytes, total_rows FROM system.tables WHERE {conditions}",
+            timeout=ESTIMATE_TIMEOUT,
+        )
+        for row in rows:
+            key = (row["database"], row["name"])
+            total_rows = row["total_rows"] or 0
+            size = (row["total_bytes"] or 0) / total_rows if total_rows else 0.0
+            _table_sizes[key] = (size, total_rows, now + TABLE_SIZE_TTL)
+            sizes[key] = (size, total_rows)
+    return sizes
+
+
+async def estimate_query_async(query: str) -> CostEstimate:
+    """Estimate the rows, parts, marks and bytes a SELECT will read.
+
+    Runs EXPLAIN ESTIMATE, which only looks at the primary key index and
+    part metadata, so it is cheap even for queries that would scan
+    everything. Only MergeTree tables are counted.
+    """
+    rows = await execute_query_async(f"EXPLAIN ESTIMATE {query}", timeout=ESTIMATE_TIMEOUT)
+    estimate = CostEstimate()
+    if not rows:
+        return estimate
+
+    sizes = await _sizes({(row["database"], row["table"]) for row in rows})
+    for row in rows:
+        estimate.rows += row["rows"]
+        estimate.parts += row["parts"]
+        estimate.marks += row["marks"]
+        estimate.bytes += int(row["rows"] * sizes.get((row["database"], row["table"]), (0.0, 0))[0])
+    estimate.table_rows = sum(total_rows for _, total_rows in sizes.values())
+    return estimate
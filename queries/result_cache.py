@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Awaitable, Callable, Hashable
+from queries.base import ColumnarResult
+
+logger = logging.getLogger(__name__)
+
+QA_RESULT_CACHE_TTL = float(os.getenv("QA_RESULT_CACHE_TTL", "600"))
+QA_RESULT_CACHE_MAX_BYTES = int(os.getenv("QA_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_SQL_TOKEN_RE = re.compile(
+    r"""
+    (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|`[^`]*`)
+    |(?P<comment>--[^\n]*|/\*.*?\*/)
+    |(?P<space>\s+)
+    |(?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Strip comments, collapse whitespace and drop the trailing semicolon.
+
+    String literals and quoted identifiers are left untouched, so two
+    queries map to the same key only if they are semantically identical.
+    """
+    parts = []
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(match.group())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def estimate_size(result: ColumnarResult) -> int:
+    """Rough in-memory size of a result set in bytes."""
+    size = 64
+    for column in result.columns:
+        # list slot + object header per value, plus the text length of each value
+        size += 56 + sum(len(str(v)) for v in column) + 40 * len(column)
+    return size
+
+
+@dataclass
+class _Entry:
+    result: ColumnarResult
+    size: int
+    expires_at: float
+
+
+class ResultCache:
+    """Size-bounded LRU cache of query results with single-flight execution.
+
+    Keys are canonicalized SQL plus the data watermark, so results are
+    dropped as soon as newer data lands and otherwise live for `ttl`
+    seconds. Identical queries arriving while one is already running wait
+    for that execution instead of starting their own. Cached results are
+    shared between callers and must not be mutated.
+    """
+
+    def __init__(self, ttl: float = QA_RESULT_CACHE_TTL, max_bytes: int = QA_RESULT_CACHE_MAX_BYTES):
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get_or_execute(
+        self,
+        sql: str,
+        execute: Callable[[str], Awaitable[ColumnarResult]],
+        watermark: date | None = None,
+    ) -> tuple[ColumnarResult, bool]:
+        """Return (result, from_cache) for sql, running execute(sql) on a miss."""
+        key = (canonicalize_sql(sql), watermark)
+
+        result = self._lookup(key)
+        if result is not None:
+            return result, True
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        self.misses += 1
+        task = asyncio.create_task(self._execute(key, sql, execute))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def get(self, sql: str, watermark: date | None = None) -> ColumnarResult | None:
+        """Cached result for sql, or None; never runs or waits for a query."""
+        return self._lookup((canonicalize_sql(sql), watermark))
+
+    def _lookup(self, key: Hashable) -> ColumnarResult | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() > entry.expires_at:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.result
+
+    async def _execute(self, key: Hashable, sql: str, execute) -> ColumnarResult:
+        result = await execute(sql)
+        size = estimate_size(result)
+        if size <= self._max_bytes // 4:
+            self._remove(key)
+            self._entries[key] = _Entry(result, size, time.monotonic() + self._ttl)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        else:
+            logger.info("Result of %d bytes too large to cache", size)
+        return result
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
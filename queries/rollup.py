@@ -0,0 +1,349 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import date, timedelta
+from queries.base import execute_query_async, execute_query_columnar_async
+from queries.activity import get_last_available_date
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_PATH = os.getenv("ROLLUP_PATH", ".cache/rollup.sqlite3")
+# Days ingested when the store is empty
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ROLLUP_BACKFILL_DAYS", "35"))
+# Recent days whose row counts are re-checked on every sync to catch late data
+ROLLUP_RECHECK_DAYS = int(os.getenv("ROLLUP_RECHECK_DAYS", "14"))
+ROLLUP_RETENTION_DAYS = int(os.getenv("ROLLUP_RETENTION_DAYS", "400"))
+ROLLUP_BATCH_DAYS = int(os.getenv("ROLLUP_BATCH_DAYS", "7"))
+ROLLUP_SYNC_INTERVAL = float(os.getenv("ROLLUP_SYNC_INTERVAL", "300"))
+
+_GROUPS_QUERY = """
+SELECT
+    day,
+    tag.1 AS dimension,
+    tag.2 AS key,
+    tag.3 AS extra,
+    count() AS submissions,
+    count(DISTINCT student_id) AS students,
+    count(DISTINCT school) AS schools,
+    count(DISTINCT region) AS regions,
+    ifNull(sum(toFloat64(result_percent)), 0) AS score_sum,
+    count(result_percent) AS score_count
+FROM (
+    SELECT
+        toDate(submission_date) AS day,
+        student_id, school, region, parallel, work_type, status, result_percent
+    FROM work_results_n
+    WHERE day IN ({days})
+)
+ARRAY JOIN [
+    -- "total" is the whole day
+    ('total', '', ''),
+    ('parallel', parallel, ''),
+    ('work_type', work_type, ''),
+    ('region', region, ''),
+    ('school', school, region),
+    ('status', status, '')
+] AS tag
+GROUP BY day, dimension, key, extra
+"""
+
+_STUDENTS_QUERY = """
+SELECT DISTINCT toDate(submission_date) AS day, toString(student_id) AS student_id
+FROM work_results_n
+WHERE day IN ({days})
+"""
+
+_DAY_COUNTS_QUERY = """
+SELECT toDate(submission_date) AS day, count() AS submissions
+FROM work_results_n
+WHERE day >= '{start}' AND day <= '{end}'
+GROUP BY day
+"""
+
+
+def _days(start: date, end: date) -> list[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+class RollupStore:
+    """Per-day aggregates of work_results_n in a local SQLite file.
+
+    For every day it keeps one row per (dimension, key) with submissions,
+    distinct students/schools/regions and the score sum, plus the set of
+    distinct student ids so counts over several days stay exact. sync()
+    ingests the days up to get_last_available_date() and rebuilds any
+    recent day whose row count in ClickHouse no longer matches, so late
+    data is picked up. Reads never touch ClickHouse.
+    """
+
+    def __init__(self, path: str = ROLLUP_PATH):
+        self._lock = threading.Lock()
+        self._sync_lock = asyncio.Lock()
+        self._synced_at = 0.0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS daily_groups (
+                    day TEXT NOT NULL,
+                    dimension TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    extra TEXT NOT NULL,
+                    submissions INTEGER NOT NULL,
+                    students INTEGER NOT NULL,
+                    schools INTEGER NOT NULL,
+                    regions INTEGER NOT NULL,
+                    score_sum REAL NOT NULL,
+                    score_count INTEGER NOT NULL,
+                    PRIMARY KEY (day, dimension, key, extra)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS daily_groups_dimension ON daily_groups (dimension, day);
+                CREATE TABLE IF NOT EXISTS daily_students (
+                    day TEXT NOT NULL,
+                    student_id TEXT NOT NULL,
+                    PRIMARY KEY (day, student_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                """
+            )
+
+    # --- sync -------------------------------------------------------------
+
+    def _get_meta(self, key: str) -> date | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def _stored_counts(self, start: date, end: date) -> dict[date, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT day, submissions FROM daily_groups
+                WHERE dimension = 'total' AND day >= ? AND day <= ?
+                """,
+                (str(start), str(end)),
+            ).fetchall()
+        return {date.fromisoformat(day): submissions for day, submissions in rows}
+
+    def _replace_days(self, days: list[date], groups: list[tuple], students: list[tuple]) -> None:
+        keys = [(str(day),) for day in days]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM daily_groups WHERE day = ?", keys)
+            self._conn.executemany("DELETE FROM daily_students WHERE day = ?", keys)
+            self._conn.executemany(
+                "INSERT INTO daily_groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", groups,
+            )
+            self._conn.executemany("INSERT INTO daily_students VALUES (?, ?)", students)
+
+    def _finish_sync(self, synced_from: date, watermark: date) -> None:
+        oldest = str(watermark - timedelta(days=ROLLUP_RETENTION_DAYS))
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM daily_groups WHERE day < ?", (oldest,))
+            self._conn.execute("DELETE FROM daily_students WHERE day < ?", (oldest,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [("synced_from", str(max(synced_from, date.fromisoformat(oldest)))),
+                 ("watermark", str(watermark))],
+            )
+
+    async def _ingest(self, days: list[date]) -> None:
+        day_list = ", ".join(f"'{day}'" for day in days)
+        groups = await execute_query_columnar_async(_GROUPS_QUERY.format(days=day_list))
+        students = await execute_query_columnar_async(_STUDENTS_QUERY.format(days=day_list))
+        group_rows = [(str(row[0]), *row[1:]) for row in groups.rows()]
+        student_rows = [(str(day), student_id) for day, student_id in students.rows()]
+        await asyncio.to_thread(self._replace_days, days, group_rows, student_rows)
+
+    async def sync(self, since: date | None = None) -> list[date]:
+        """Bring the store up to the data watermark; returns the rebuilt days.
+
+        `since` extends the covered range back to that day if needed.
+        """
+        async with self._sync_lock:
+            watermark = await get_last_available_date()
+            synced_from = await asyncio.to_thread(self._get_meta, "synced_from")
+            stored_watermark = await asyncio.to_thread(self._get_meta, "watermark")
+
+            recheck_from = watermark - timedelta(days=ROLLUP_RECHECK_DAYS)
+            if synced_from is None:
+                start = min(recheck_from, watermark - timedelta(days=ROLLUP_BACKFILL_DAYS))
+            else:
+                start = max(synced_from, recheck_from)
+                if stored_watermark is not None:
+                    # Days missed while the store was not synced
+                    start = min(start, stored_watermark + timedelta(days=1))
+            if since is not None:
+                start = min(start, since)
+
+            counts = await execute_query_async(_DAY_COUNTS_QUERY.format(start=start, end=watermark))
+            remote = {row["day"]: row["submissions"] for row in counts}
+            stored = await asyncio.to_thread(self._stored_counts, start, watermark)
+            stale = [day for day in _days(start, watermark) if remote.get(day, 0) != stored.get(day, 0)]
+
+            for i in range(0, len(stale), ROLLUP_BATCH_DAYS):
+                await self._ingest(stale[i:i + ROLLUP_BATCH_DAYS])
+
+            new_from = start if synced_from is None else min(synced_from, start)
+            await asyncio.to_thread(self._finish_sync, new_from, watermark)
+            self._synced_at = time.monotonic()
+            if stale:
+                logger.info("Rollup: rebuilt %d day(s) up to %s: %s", len(stale), watermark,
+                            ", ".join(str(day) for day in stale))
+            return stale
+
+    async def ensure_synced(self, since: date | None = None, max_age: float = ROLLUP_SYNC_INTERVAL) -> None:
+        """sync() unless it ran within `max_age` seconds and covers `since`."""
+        synced_from = await asyncio.to_thread(self._get_meta, "synced_from")
+        covered = synced_from is not None and (since is None or since >= synced_from)
+        if covered and time.monotonic() - self._synced_at <= max_age:
+            return
+        await self.sync(since)
+
+    # --- reads ------------------------------------------------------------
+
+    def _daily(self, day: date) -> dict:
+        row = self._conn.execute(
+            """
+            SELECT submissions, students, schools, regions FROM daily_groups
+            WHERE day = ? AND dimension = 'total'
+            """,
+            (str(day),),
+        ).fetchone() or (0, 0, 0, 0)
+        return dict(zip(("total_submissions", "active_students", "active_schools", "active_regions"), row))
+
+    def _trend(self, start: date, end: date) -> list[dict]:
+        rows = self._conn.execute(
+            """
+            SELECT day, submissions, students FROM daily_groups
+            WHERE dimension = 'total' AND day >= ? AND day <= ?
+            ORDER BY day
+            """,
+            (str(start), str(end)),
+        ).fetchall()
+        return [
+            {"day": date.fromisoformat(day), "submissions": submissions, "students": students}
+            for day, submissions, students in rows
+        ]
+
+    def _period(self, start: date, end: date) -> dict:
+        bounds = (str(start), str(end))
+        submissions = self._conn.execute(
+            "SELECT coalesce(sum(submissions), 0) FROM daily_groups "
+            "WHERE dimension = 'total' AND day >= ? AND day <= ?",
+            bounds,
+        ).fetchone()[0]
+        schools = self._conn.execute(
+            "SELECT count(DISTINCT key) FROM daily_groups "
+            "WHERE dimension = 'school' AND day >= ? AND day <= ?",
+            bounds,
+        ).fetchone()[0]
+        students = self._conn.execute(
+            "SELECT count(DISTINCT student_id) FROM daily_students WHERE day >= ? AND day <= ?",
+            bounds,
+        ).fetchone()[0]
+        return {
+            "submissions": submissions,
+            "active_schools": schools,
+            "active_students": students,
+            "start_date": str(start),
+            "end_date": str(end),
+        }
+
+    def _groups(self, day: date, dimension: str, order: str, limit: int = -1) -> list[tuple]:
+        return self._conn.execute(
+            f"""
+            SELECT key, extra, submissions, students, schools,
+                   CASE WHEN score_count > 0 THEN round(score_sum / score_count, 1) ELSE 0.0 END
+            FROM daily_groups
+            WHERE day = ? AND dimension = ? AND key != ''
+            ORDER BY {order}
+            LIMIT ?
+            """,
+            (str(day), dimension, limit),
+        ).fetchall()
+
+    def activity_metrics(self, target_date: date, limit: int = 10) -> dict:
+        """Report metrics for target_date, same shape as get_consolidated_activity_metrics."""
+        this_week_start = target_date - timedelta(days=target_date.weekday())
+        last_week_start = this_week_start - timedelta(days=7)
+        last_week_end = target_date - timedelta(days=7)
+        by_submissions = "submissions DESC, key"
+
+        with self._lock:
+            return {
+                "activity_today": self._daily(target_date),
+                "activity_yesterday": self._daily(target_date - timedelta(days=1)),
+                "weekly_trend": self._trend(this_week_start, target_date),
+                "weekly_comparison": {
+                    "this_week": self._period(this_week_start, target_date),
+                    "last_week": self._period(last_week_start, last_week_end),
+                },
+                "by_parallel": [
+                    {"parallel": key, "submissions": submissions, "students": students}
+                    for key, _, submissions, students, _, _ in self._groups(target_date, "parallel", "key")
+                ],
+                "by_work_type": [
+                    {"work_type": key, "submissions": submissions, "avg_score": avg_score}
+                    for key, _, submissions, _, _, avg_score
+                    in self._groups(target_date, "work_type", by_submissions)
+                ],
+                "top_schools": [
+                    {"school": key, "region": extra, "submissions": submissions, "students": students}
+                    for key, extra, submissions, students, _, _
+                    in self._groups(target_date, "school", by_submissions, limit)
+                ],
+                "top_regions": [
+                    {"region": key, "submissions": submissions, "schools": schools, "students": students}
+                    for key, _, submissions, students, schools, _
+                    in self._groups(target_date, "region", by_submissions, limit)
+                ],
+                "status_breakdown": [
+                    {"status": key, "cnt": submissions}
+                    for key, _, submissions, _, _, _ in self._groups(target_date, "status", by_submissions)
+                ],
+            }
+
+    async def get_activity_metrics(self, target_date: date, limit: int = 10) -> dict:
+        """Sync if needed, then read the report metrics for target_date locally.
+
+        Raises LookupError if target_date is past the data watermark, as the
+        store cannot tell an empty day from one not ingested yet.
+        """
+        last_week_start = target_date - timedelta(days=target_date.weekday() + 7)
+        if last_week_start < date.today() - timedelta(days=ROLLUP_RETENTION_DAYS):
+            raise LookupError(f"{target_date} is older than ROLLUP_RETENTION_DAYS")
+        await self.ensure_synced(since=last_week_start)
+        watermark = await asyncio.to_thread(self._get_meta, "watermark")
+        if watermark is None or target_date > watermark:
+            raise LookupError(f"Rollup has no data for {target_date} (watermark {watermark})")
+        return await asyncio.to_thread(self.activity_metrics, target_date, limit)
+
+    def stats(self) -> dict:
+        with self._lock:
+            days, groups = self._conn.execute(
+                "SELECT count(DISTINCT day), count(*) FROM daily_groups"
+            ).fetchone()
+            students = self._conn.execute("SELECT count(*) FROM daily_students").fetchone()[0]
+            meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        return {"days": days, "groups": groups, "student_days": students, **meta}
+
+
+_rollup_store: RollupStore | None = None
+
+
+def get_rollup_store() -> RollupStore:
+    """Lazy initialization of the rollup store, so importing this module
+    does not create the SQLite file in processes that never use it."""
+    global _rollup_store
+    if _rollup_store is None:
+        _rollup_store = RollupStore()
+    return _rollup_store
@@ -0,0 +1,138 @@
+"""Generate activity reports for a range of dates.
+
+Metrics for the whole range come from the local rollup (queries.rollup),
+synced once up front, so days shared by neighbouring weekly windows are
+read from ClickHouse only once; dates the rollup cannot serve fall back to
+get_all_activity_metrics. Reports are generated concurrently and written
+to <out-dir>/<date>.md, with the metrics they were built from in
+<out-dir>/<date>.json.
+
+Usage: python report_batch.py START [END] [--out-dir DIR]
+           [--ch-concurrency N] [--llm-concurrency N] [--overwrite]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import date, timedelta
+from dotenv import load_dotenv
+
+from queries.base import warm_up
+from queries.activity import get_all_activity_metrics
+from queries.rollup import get_rollup_store
+from ai.insights import generate_activity_report
+
+load_dotenv()
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger(__name__)
+
+
+async def collect_metrics(target_date: date, ch_semaphore: asyncio.Semaphore, use_rollup: bool = True) -> dict:
+    """Report metrics for one date, from the rollup if it can serve them."""
+    start = time.monotonic()
+    if not use_rollup:
+        async with ch_semaphore:
+            return await get_all_activity_metrics(target_date)
+    try:
+        metrics = await get_rollup_store().get_activity_metrics(target_date)
+        return {
+            "date": str(target_date),
+            **metrics,
+            "missing": [],
+            "timings_ms": {"rollup": int((time.monotonic() - start) * 1000)},
+        }
+    except Exception as e:
+        logger.warning("Rollup cannot serve %s, querying ClickHouse: %r", target_date, e)
+    async with ch_semaphore:
+        return await get_all_activity_metrics(target_date)
+
+
+async def generate_one(
+    target_date: date,
+    out_dir: str,
+    ch_semaphore: asyncio.Semaphore,
+    llm_semaphore: asyncio.Semaphore,
+    use_rollup: bool = True,
+) -> bool:
+    """Write the report and metrics for target_date; True on success."""
+    try:
+        metrics = await collect_metrics(target_date, ch_semaphore, use_rollup)
+        async with llm_semaphore:
+            report = await generate_activity_report(metrics)
+    except Exception:
+        logger.exception("Report for %s failed", target_date)
+        return False
+
+    with open(os.path.join(out_dir, f"{target_date}.json"), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2, default=str)
+    with open(os.path.join(out_dir, f"{target_date}.md"), "w", encoding="utf-8") as f:
+        f.write(report)
+    if metrics.get("missing"):
+        logger.warning("Report for %s is missing sections: %s", target_date, metrics["missing"])
+    logger.info("Report for %s written", target_date)
+    return True
+
+
+async def run(args: argparse.Namespace) -> int:
+    end = args.end or args.start
+    if end < args.start:
+        print("END must not be before START", file=sys.stderr)
+        return 2
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    dates = [args.start + timedelta(days=i) for i in range((end - args.start).days + 1)]
+    if not args.overwrite:
+        dates = [d for d in dates if not os.path.exists(os.path.join(args.out_dir, f"{d}.md"))]
+    if not dates:
+        print("All reports already exist; use --overwrite to regenerate")
+        return 0
+
+    warm_up()
+    # One sync covers every weekly window in the range (each report also
+    # needs the week before its own). If it fails, every date goes straight
+    # to ClickHouse rather than retrying the sync once per date
+    use_rollup = True
+    try:
+        await get_rollup_store().sync(since=dates[0] - timedelta(days=dates[0].weekday() + 7))
+    except Exception as e:
+        use_rollup = False
+        logger.warning("Rollup sync failed, reports will query ClickHouse directly: %r", e)
+
+    ch_semaphore = asyncio.Semaphore(args.ch_concurrency)
+    llm_semaphore = asyncio.Semaphore(args.llm_concurrency)
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *(generate_one(d, args.out_dir, ch_semaphore, llm_semaphore, use_rollup) for d in dates)
+    )
+
+    failed = [str(d) for d, ok in zip(dates, results) if not ok]
+    print(f"{len(dates) - len(failed)}/{len(dates)} report(s) written to {args.out_dir} "
+          f"in {time.monotonic() - start:.1f}s")
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("start", type=date.fromisoformat, help="first date, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", type=date.fromisoformat, help="last date (default: START)")
+    parser.add_argument("--out-dir", default="reports_out")
+    parser.add_argument("--ch-concurrency", type=int, default=2,
+                        help="dates queried from ClickHouse at once when the rollup cannot serve them")
+    parser.add_argument("--llm-concurrency", type=int, default=4,
+                        help="reports generated by the LLM at once")
+    parser.add_argument("--overwrite", action="store_true", help="regenerate reports that already exist")
+    return asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
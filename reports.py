@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Awaitable, Callable
+
+from queries.activity import get_all_activity_metrics
+from ai.insights import generate_activity_report
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "21600"))  # 6 hours
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "7"))
+
+
+class ReportStore:
+    """Pre-rendered activity reports with single-flight generation.
+
+    The scheduled job renders the daily report and stores it here, so
+    /report can answer instantly. Concurrent requests for a report that is
+    not stored yet share one in-flight generation instead of each running
+    the ClickHouse queries and the LLM call.
+    """
+
+    def __init__(self, ttl: float = REPORT_CACHE_TTL, max_entries: int = REPORT_CACHE_SIZE):
+        self._reports: OrderedDict[date, tuple[str, float]] = OrderedDict()
+        # (target_date, force) -> running generation
+        self._in_flight: dict[tuple[date, bool], asyncio.Task] = {}
+        self._ttl = ttl
+        self._max_entries = max_entries
+
+    def get_cached(self, target_date: date) -> str | None:
+        """Return the stored report for target_date if it is still fresh."""
+        entry = self._reports.get(target_date)
+        if entry is None:
+            return None
+        report, generated_at = entry
+        if time.time() - generated_at > self._ttl:
+            del self._reports[target_date]
+            return None
+        return report
+
+    async def get(
+        self,
+        target_date: date = None,
+        force: bool = False,
+        on_delta: Callable[[str], Awaitable[None]] | None = None,
+    ) -> str:
+        """Return the report for target_date (yesterday by default).
+
+        With force=True the stored report is ignored and regenerated from
+        fresh metrics; only another forced generation in flight is shared,
+        while a non-forced call joins either kind.
+        on_delta receives the text as it streams, but only if this call
+        starts the generation.
+        """
+        if target_date is None:
+            target_date = date.today() - timedelta(days=1)
+
+        if not force:
+            report = self.get_cached(target_date)
+            if report is not None:
+                logger.info("Report for %s served from cache", target_date)
+                return report
+
+        key = (target_date, force)
+        task = self._in_flight.get(key)
+        if task is None and not force:
+            task = self._in_flight.get((target_date, True))
+        if task is None:
+            task = asyncio.create_task(self._generate(target_date, force, on_delta))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            logger.info("Joining in-flight report generation for %s", target_date)
+        # Shielded so one caller giving up does not cancel the others
+        return await asyncio.shield(task)
+
+    async def _generate(
+        self,
+        target_date: date,
+        force: bool,
+        on_delta: Callable[[str], Awaitable[None]] | None,
+    ) -> str:
+        logger.info("Generating report for %s (force=%s)", target_date, force)
+        metrics = await get_all_activity_metrics(target_date, use_cache=not force)
+        report = await generate_activity_report(metrics, on_delta=on_delta)
+        if metrics.get("missing"):
+            logger.warning("Report for %s is partial, not storing it", target_date)
+            return report
+
+        self._reports[target_date] = (report, time.time())
+        self._reports.move_to_end(target_date)
+        while len(self._reports) > self._max_entries:
+            self._reports.popitem(last=False)
+        return report
+
+
+report_store = ReportStore()
@@ -0,0 +1,2 @@
+-- Whether the SQL for the exchange came from the local question -> SQL cache
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS sql_cache_hit boolean NOT NULL DEFAULT false;
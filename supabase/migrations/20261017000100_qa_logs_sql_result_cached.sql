@@ -0,0 +1,3 @@
+-- Whether the query result was served from the Q&A result cache
+-- (sql_execution_time_ms is then the cache lookup time, not ClickHouse time)
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS sql_result_cached boolean NOT NULL DEFAULT false;
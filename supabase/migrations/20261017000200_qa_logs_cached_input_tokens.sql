@@ -0,0 +1,2 @@
+-- Part of input_tokens served from the provider's prompt cache
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS cached_input_tokens integer NOT NULL DEFAULT 0;
@@ -0,0 +1,6 @@
+-- EXPLAIN ESTIMATE of the executed query (NULL if it was not estimated)
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS estimated_rows bigint;
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS estimated_parts integer;
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS estimated_bytes bigint;
+-- Days of the default date window added to an unbounded query (NULL if none)
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS date_window_days integer;
@@ -0,0 +1,70 @@
+-- Server-side aggregation for the /stat command, so the bot no longer
+-- downloads every qa_logs row of the period.
+
+CREATE INDEX IF NOT EXISTS qa_logs_created_at_idx ON qa_logs (created_at);
+CREATE INDEX IF NOT EXISTS qa_logs_user_created_at_idx ON qa_logs (telegram_user_id, created_at DESC);
+
+-- Totals for the period (since = NULL means all time)
+CREATE OR REPLACE FUNCTION qa_stats_totals(since timestamptz DEFAULT NULL)
+RETURNS TABLE (users bigint, requests bigint, input_tokens bigint, output_tokens bigint)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        count(DISTINCT l.telegram_user_id),
+        count(*),
+        coalesce(sum(l.input_tokens), 0),
+        coalesce(sum(l.output_tokens), 0)
+    FROM qa_logs l
+    WHERE since IS NULL OR l.created_at >= since;
+$$;
+
+-- One page of per-user totals, most tokens first
+CREATE OR REPLACE FUNCTION qa_stats_by_user(
+    since timestamptz DEFAULT NULL,
+    page_size integer DEFAULT 10,
+    page_offset integer DEFAULT 0
+)
+RETURNS TABLE (
+    telegram_user_id bigint,
+    telegram_username text,
+    requests bigint,
+    input_tokens bigint,
+    output_tokens bigint
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        l.telegram_user_id,
+        (array_agg(l.telegram_username ORDER BY l.created_at DESC)
+            FILTER (WHERE l.telegram_username IS NOT NULL))[1],
+        count(*),
+        coalesce(sum(l.input_tokens), 0),
+        coalesce(sum(l.output_tokens), 0)
+    FROM qa_logs l
+    WHERE since IS NULL OR l.created_at >= since
+    GROUP BY l.telegram_user_id
+    ORDER BY coalesce(sum(l.input_tokens), 0) + coalesce(sum(l.output_tokens), 0) DESC,
+             l.telegram_user_id
+    LIMIT page_size OFFSET page_offset;
+$$;
+
+-- Latest questions of the given users, at most per_user each
+CREATE OR REPLACE FUNCTION qa_recent_questions(
+    user_ids bigint[],
+    since timestamptz DEFAULT NULL,
+    per_user integer DEFAULT 5
+)
+RETURNS TABLE (telegram_user_id bigint, question text, created_at timestamptz)
+LANGUAGE sql STABLE AS $$
+    SELECT r.telegram_user_id, r.question, r.created_at
+    FROM (
+        SELECT
+            l.telegram_user_id,
+            l.question,
+            l.created_at,
+            row_number() OVER (PARTITION BY l.telegram_user_id ORDER BY l.created_at DESC) AS n
+        FROM qa_logs l
+        WHERE l.telegram_user_id = ANY (user_ids)
+          AND (since IS NULL OR l.created_at >= since)
+    ) r
+    WHERE r.n <= per_user
+    ORDER BY r.telegram_user_id, r.created_at DESC;
+$$;
@@ -0,0 +1,2 @@
+-- Input tokens saved by compacting the conversation history vs. replaying it verbatim
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS history_tokens_saved integer NOT NULL DEFAULT 0;
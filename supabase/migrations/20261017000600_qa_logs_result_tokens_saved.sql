@@ -0,0 +1,2 @@
+-- Input tokens saved by the compact result serialization vs. the raw repr of the rows
+ALTER TABLE qa_logs ADD COLUMN IF NOT EXISTS result_tokens_saved integer NOT NULL DEFAULT 0;
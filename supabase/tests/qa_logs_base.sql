@@ -0,0 +1,16 @@
+-- qa_logs as first created in the Supabase dashboard (see
+-- docs/plans/2026-02-22-qa-logging-design.md); the migrations build on it.
+CREATE TABLE IF NOT EXISTS qa_logs (
+    id uuid DEFAULT gen_random_uuid() PRIMARY KEY,
+    telegram_user_id bigint NOT NULL,
+    telegram_username text,
+    question text NOT NULL,
+    generated_sql text,
+    answer text,
+    success boolean NOT NULL DEFAULT true,
+    error_message text,
+    sql_execution_time_ms integer,
+    input_tokens integer,
+    output_tokens integer,
+    created_at timestamptz DEFAULT now()
+);
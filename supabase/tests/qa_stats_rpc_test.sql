@@ -0,0 +1,54 @@
+-- Fixture and checks for the /stat RPCs (20261017000400_qa_stats_rpc.sql).
+-- Run by supabase/tests/run.sh after the base table and all migrations.
+
+INSERT INTO qa_logs (telegram_user_id, telegram_username, question, input_tokens, output_tokens, created_at) VALUES
+    -- user 1: renamed, the newest username wins
+    (1, 'alice_old', 'q1-a', 10, 5, now() - interval '1 day'),
+    (1, 'alice', 'q1-b', 20, 10, now() - interval '2 hours'),
+    -- user 2: no username, most tokens, outside a 3-day window
+    (2, NULL, 'q2-a', 100, 50, now() - interval '10 days'),
+    -- user 3: more questions than per_user
+    (3, 'carol', 'q3-1', 1, 1, now() - interval '6 hours'),
+    (3, 'carol', 'q3-2', 1, 1, now() - interval '5 hours'),
+    (3, 'carol', 'q3-3', 1, 1, now() - interval '4 hours'),
+    (3, 'carol', 'q3-4', 1, 1, now() - interval '3 hours'),
+    (3, 'carol', 'q3-5', 1, 1, now() - interval '2 hours'),
+    (3, NULL, 'q3-6', NULL, NULL, now() - interval '1 hour');
+
+DO $$
+DECLARE
+    t record;
+    ids bigint[];
+    names text[];
+    questions text[];
+BEGIN
+    SELECT * INTO t FROM qa_stats_totals();
+    ASSERT (t.users, t.requests, t.input_tokens, t.output_tokens) = (3::bigint, 9::bigint, 135::bigint, 70::bigint),
+        format('totals, all time: %s', t);
+
+    SELECT * INTO t FROM qa_stats_totals(now() - interval '3 days');
+    ASSERT (t.users, t.requests) = (2::bigint, 8::bigint), format('totals, 3 days: %s', t);
+
+    SELECT array_agg(telegram_user_id), array_agg(telegram_username)
+      INTO ids, names FROM qa_stats_by_user(NULL, 2, 0);
+    ASSERT ids = ARRAY[2, 1]::bigint[], format('page 1 order: %s', ids);
+    ASSERT names[1] IS NULL AND names[2] = 'alice', format('page 1 usernames: %s', names);
+
+    SELECT array_agg(telegram_user_id), array_agg(telegram_username)
+      INTO ids, names FROM qa_stats_by_user(NULL, 2, 2);
+    ASSERT ids = ARRAY[3]::bigint[] AND names = ARRAY['carol'], format('page 2: %s %s', ids, names);
+
+    SELECT array_agg(telegram_user_id) INTO ids FROM qa_stats_by_user(now() - interval '3 days');
+    ASSERT ids = ARRAY[1, 3]::bigint[], format('users, 3 days: %s', ids);
+
+    SELECT array_agg(question) INTO questions FROM qa_recent_questions(ARRAY[1, 3]::bigint[], NULL, 5);
+    ASSERT questions = ARRAY['q1-b', 'q1-a', 'q3-6', 'q3-5', 'q3-4', 'q3-3', 'q3-2'],
+        format('recent questions: %s', questions);
+
+    SELECT array_agg(question) INTO questions
+      FROM qa_recent_questions(ARRAY[1, 2]::bigint[], now() - interval '3 days', 5);
+    ASSERT questions = ARRAY['q1-b', 'q1-a'], format('recent questions, 3 days: %s', questions);
+
+    RAISE NOTICE 'qa_stats RPCs: all checks passed';
+END
+$$;
@@ -1,9 +1,23 @@
 import os
+import json
+import time
+import random
+import asyncio
 import logging
 from supabase import create_client
 
 logger = logging.getLogger(__name__)
 
+QA_LOG_QUEUE_SIZE = int(os.getenv("QA_LOG_QUEUE_SIZE", "1000"))
+QA_LOG_BATCH_SIZE = int(os.getenv("QA_LOG_BATCH_SIZE", "50"))
+QA_LOG_FLUSH_INTERVAL = float(os.getenv("QA_LOG_FLUSH_INTERVAL", "5"))
+QA_LOG_MAX_RETRIES = int(os.getenv("QA_LOG_MAX_RETRIES", "4"))
+QA_LOG_SHUTDOWN_TIMEOUT = float(os.getenv("QA_LOG_SHUTDOWN_TIMEOUT", "10"))
+# How often queue depth and counters are logged while rows are flowing
+QA_LOG_STATS_INTERVAL = float(os.getenv("QA_LOG_STATS_INTERVAL", "300"))
+# Rows that could not be written are appended here and retried later
+QA_LOG_SPILL_PATH = os.getenv("QA_LOG_SPILL_PATH", ".cache/qa_logs_spill.jsonl")
+
 _NOT_INITIALIZED = object()
 _client = _NOT_INITIALIZED
 
@@ -22,6 +36,193 @@ def _get_client():
     return _client
 
 
+class QALogWriter:
+    """Background writer that inserts qa_logs rows in batches.
+
+    submit() puts a row on a bounded in-memory queue and returns at once;
+    a full queue drops the row and counts it. A background task inserts
+    rows every `batch_size` rows or `flush_interval` seconds, retrying
+    failed inserts with jittered exponential backoff. Rows that still
+    cannot be written are appended to a JSONL spill file, which is
+    replayed after the next successful insert and on start. stop()
+    flushes the queue, spilling whatever cannot be written in time.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = QA_LOG_QUEUE_SIZE,
+        batch_size: int = QA_LOG_BATCH_SIZE,
+        flush_interval: float = QA_LOG_FLUSH_INTERVAL,
+        max_retries: int = QA_LOG_MAX_RETRIES,
+        spill_path: str = QA_LOG_SPILL_PATH,
+        stats_interval: float = QA_LOG_STATS_INTERVAL,
+    ):
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._spill_path = spill_path
+        self._stats_interval = stats_interval
+        self._stats_logged_at = time.monotonic()
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._batch: list[dict] = []
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.retries = 0
+
+    def start(self) -> None:
+        """Start the background task; must be called from the event loop."""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._task = asyncio.create_task(self._run(), name="qa-log-writer")
+
+    def submit(self, row: dict) -> None:
+        if self._task is None:
+            self.start()
+        try:
+            self._queue.put_nowait(row)
+            self.submitted += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("qa_logs queue full, row dropped (%d dropped so far)", self.dropped)
+
+    async def stop(self, timeout: float = QA_LOG_SHUTDOWN_TIMEOUT) -> None:
+        """Flush queued rows and stop; rows not written within `timeout` are spilled."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pending = self._batch
+            while not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is not None:
+                    pending.append(row)
+            if pending:
+                await asyncio.to_thread(self._spill, pending)
+            logger.warning("qa_logs writer stopped after %ss, %d row(s) spilled", timeout, len(pending))
+        logger.info("qa_logs writer stopped %s", self.stats())
+
+    async def _run(self) -> None:
+        await self._replay_spill()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                break
+            self._batch = [row]
+            deadline = time.monotonic() + self._flush_interval
+            while len(self._batch) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                self._batch.append(row)
+
+            written = await self._write(self._batch)
+            # Written or spilled: either way stop() must not spill it again
+            self._batch = []
+            if written:
+                await self._replay_spill()
+            if time.monotonic() - self._stats_logged_at >= self._stats_interval:
+                self._stats_logged_at = time.monotonic()
+                logger.info("qa_logs writer %s", self.stats())
+
+    async def _write(self, rows: list[dict]) -> bool:
+        """Insert rows, retrying with backoff; spill them if every attempt fails."""
+        for attempt in range(self._max_retries + 1):
+            try:
+                await asyncio.to_thread(_insert_qa_logs, rows)
+                self.written += len(rows)
+                logger.info("Logged %d Q&A exchange(s) to Supabase", len(rows))
+                return True
+            except Exception as e:
+                if attempt == self._max_retries:
+                    logger.warning("Failed to log %d Q&A exchange(s) to Supabase, spilling: %s", len(rows), e)
+                    break
+                self.retries += 1
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.info("qa_logs insert failed (%s), retrying in %.1fs", e, delay)
+                await asyncio.sleep(delay)
+        await asyncio.to_thread(self._spill, rows)
+        return False
+
+    def _spill(self, rows: list[dict]) -> None:
+        try:
+            if os.path.dirname(self._spill_path):
+                os.makedirs(os.path.dirname(self._spill_path), exist_ok=True)
+            with open(self._spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            self.spilled += len(rows)
+        except OSError as e:
+            self.dropped += len(rows)
+            logger.error("Could not spill %d qa_logs row(s), dropped: %s", len(rows), e)
+
+    def _take_spill(self) -> list[dict]:
+        """Read and remove the spill file (it is re-created if the replay fails)."""
+        if not os.path.exists(self._spill_path):
+            return []
+        replay_path = self._spill_path + ".replay"
+        os.replace(self._spill_path, replay_path)
+        with open(replay_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        os.remove(replay_path)
+        return rows
+
+    async def _replay_spill(self) -> None:
+        try:
+            rows = await asyncio.to_thread(self._take_spill)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read qa_logs spill file: %s", e)
+            return
+        if rows:
+            logger.info("Replaying %d spilled qa_logs row(s)", len(rows))
+        for i in range(0, len(rows), self._batch_size):
+            try:
+                written = await self._write(rows[i:i + self._batch_size])
+            except asyncio.CancelledError:
+                # Stopped mid-replay: keep everything not yet confirmed
+                self._spill(rows[i:])
+                raise
+            if not written:
+                # The rest goes back to the spill file for the next attempt
+                await asyncio.to_thread(self._spill, rows[i + self._batch_size:])
+                return
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "retries": self.retries,
+        }
+
+
+def _insert_qa_logs(rows: list[dict]) -> None:
+    client = _get_client()
+    if client is None:
+        return
+    client.table("qa_logs").insert(rows).execute()
+
+
+qa_log_writer = QALogWriter()
+
+
 def log_qa_exchange(
     telegram_user_id: int,
     telegram_username: str | None,
@@ -33,14 +234,25 @@ def log_qa_exchange(
     sql_execution_time_ms: int | None,
     input_tokens: int,
     output_tokens: int,
+    cached_input_tokens: int = 0,
+    sql_cache_hit: bool = False,
+    sql_result_cached: bool = False,
+    estimated_rows: int | None = None,
+    estimated_parts: int | None = None,
+    estimated_bytes: int | None = None,
+    date_window_days: int | None = None,
+    result_tokens_saved: int = 0,
+    history_tokens_saved: int = 0,
 ) -> None:
-    """Log a Q&A exchange to Supabase. Fire-and-forget -- never raises."""
+    """Queue a Q&A exchange for logging to Supabase. Never raises or blocks.
+
+    Rows are written in batches by qa_log_writer in the background.
+    """
     try:
-        client = _get_client()
-        if client is None:
+        if _get_client() is None:
             return
 
-        client.table("qa_logs").insert({
+        qa_log_writer.submit({
             "telegram_user_id": telegram_user_id,
             "telegram_username": telegram_username,
             "question": question,
@@ -51,24 +263,56 @@ def log_qa_exchange(
             "sql_execution_time_ms": sql_execution_time_ms,
             "input_tokens": input_tokens,
             "output_tokens": output_tokens,
-        }).execute()
-
-        logger.info("Q&A exchange logged to Supabase for user %s", telegram_user_id)
+            "cached_input_tokens": cached_input_tokens,
+            "sql_cache_hit": sql_cache_hit,
+            "sql_result_cached": sql_result_cached,
+            "estimated_rows": estimated_rows,
+            "estimated_parts": estimated_parts,
+            "estimated_bytes": estimated_bytes,
+            "date_window_days": date_window_days,
+            "result_tokens_saved": result_tokens_saved,
+            "history_tokens_saved": history_tokens_saved,
+        })
     except Exception as e:
-        logger.warning("Failed to log Q&A exchange to Supabase: %s", e)
+        logger.warning("Failed to queue Q&A exchange for Supabase: %s", e)
 
 
-def get_qa_stats(since_iso: str | None = None) -> list[dict]:
-    """Fetch qa_logs rows, optionally filtered by created_at >= since_iso."""
+def get_qa_stats_totals(since_iso: str | None = None) -> dict:
+    """Users, requests and token sums in qa_logs since since_iso (all time if None)."""
     client = _get_client()
     if client is None:
-        return []
+        return {"users": 0, "requests": 0, "input_tokens": 0, "output_tokens": 0}
 
-    query = client.table("qa_logs").select(
-        "telegram_user_id, telegram_username, question, input_tokens, output_tokens"
-    )
-    if since_iso is not None:
-        query = query.gte("created_at", since_iso)
+    response = client.rpc("qa_stats_totals", {"since": since_iso}).execute()
+    return response.data[0]
 
-    response = query.execute()
+
+def get_qa_user_stats(since_iso: str | None = None, limit: int = 10, offset: int = 0) -> list[dict]:
+    """One page of per-user request counts and token sums, most tokens first."""
+    client = _get_client()
+    if client is None:
+        return []
+
+    response = client.rpc(
+        "qa_stats_by_user", {"since": since_iso, "page_size": limit, "page_offset": offset},
+    ).execute()
     return response.data
+
+
+def get_recent_questions(
+    user_ids: list[int],
+    since_iso: str | None = None,
+    per_user: int = 5,
+) -> dict[int, list[str]]:
+    """Latest questions of each user, newest first, at most per_user each."""
+    client = _get_client()
+    if client is None or not user_ids:
+        return {}
+
+    response = client.rpc(
+        "qa_recent_questions", {"user_ids": user_ids, "since": since_iso, "per_user": per_user},
+    ).execute()
+    questions: dict[int, list[str]] = {}
+    for row in response.data:
+        questions.setdefault(row["telegram_user_id"], []).append(row["question"])
+    return questions